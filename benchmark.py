@@ -0,0 +1,209 @@
+"""
+Offline benchmarks for the render and I/O hot paths
+
+    python3 benchmark.py                          # run everything, print a table
+    python3 benchmark.py --output bench.json      # also save results
+    python3 benchmark.py --compare bench.json     # show the change against earlier results
+
+Images are generated (photo-like, flat graphics and images with alpha) at several resolutions and
+downloads and timeline paging go through a local stand-in server, so no network or account is needed.
+"""
+
+import argparse
+import io
+import json
+import os
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+import requests
+from PIL import Image
+
+DEFAULT_SIZES = (320, 640, 1080)
+CONTENT_TYPES = ('photo', 'flat', 'alpha')
+
+def make_content(kind, size, seed=0):
+    """Return (RGB or RGBA array, format) for a synthetic image of the given kind"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size] / float(size)
+    if kind == 'photo':
+        # smooth gradients plus sensor-like noise - compresses and renders like a photo
+        base = np.stack([np.sin(x * 6 + seed) * 0.5 + 0.5, y, np.cos((x + y) * 4) * 0.5 + 0.5], axis=-1) * 255
+        pixels = np.clip(base + rng.normal(0, 12, base.shape), 0, 255).astype(np.uint8)
+        return pixels, 'JPEG'
+    if kind == 'flat':
+        # a few solid blocks - long runs of equal color
+        pixels = np.zeros((size, size, 3), dtype=np.uint8)
+        for _ in range(8):
+            x0, y0 = rng.integers(0, size, 2)
+            pixels[y0:y0 + size // 3, x0:x0 + size // 3] = rng.integers(0, 256, 3)
+        return pixels, 'PNG'
+    if kind == 'alpha':
+        pixels, _ = make_content('photo', size, seed)
+        alpha = np.where((x - 0.5) ** 2 + (y - 0.5) ** 2 < 0.16, 255, (x * 255).astype(np.uint8))
+        return np.dstack([pixels, alpha.astype(np.uint8)]), 'PNG'
+    raise ValueError('unknown content type ' + kind)
+
+def encode(pixels, fmt):
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, format=fmt)
+    return buf.getvalue()
+
+def measure(func, repeat):
+    """
+    Run func repeat times. Returns (best wall time, peak traced memory of one run, result)
+
+    Peak memory comes from tracemalloc, so it covers Python and NumPy allocations but not Pillow's
+    internal image buffers.
+    """
+    tracemalloc.start()
+    result = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, peak, result
+
+def render_cases(content, repeat):
+    import color.ansi
+    import display
+    from color.dither import DITHER_METHODS
+    from color.img2txt import img_to_ansi
+
+    info = {'username': 'bench', 'site_url': 'https://example.com/p/x/', 'likes': '0', 'caption': ''}
+    color_img = display.prepare_image(content, display.MODE_ANSI)
+    pixels = color_img.load()
+
+    cases = {
+        'ansi_from_pixels': lambda: color.ansi.generate_ANSI_from_pixels(pixels, color_img.width, color_img.height, None)[0],
+        'ansi_from_array': lambda: img_to_ansi(color_img),
+    }
+    braille_img = display.prepare_image(content, display.MODE_BRAILLE)
+    for method in DITHER_METHODS:
+        settings = dict(display.braille_settings(), dither_method=method)
+        cases['dither_braille_' + method] = lambda settings=settings: display.render_image(braille_img, display.MODE_BRAILLE, **settings)
+        cases['dither_ansi_' + method] = lambda method=method: img_to_ansi(color_img, dither_method=method)
+    for mode in display.MODES:
+        prepared = display.prepare_image(content, mode)
+        cases['decode_' + mode] = lambda mode=mode: display.prepare_image(content, mode).size
+        cases['render_' + mode] = lambda mode=mode, prepared=prepared: display.render_post(prepared, info, mode)
+        cases['post_' + mode] = lambda mode=mode: display.render_post(content, info, mode)
+    for name, func in cases.items():
+        elapsed, peak, result = measure(func, repeat)
+        out_bytes = len(result.encode('utf-8')) if isinstance(result, str) else 0
+        yield name, {'seconds': elapsed, 'peak_bytes': peak, 'output_bytes': out_bytes}
+
+def download_case(images, delay, workers, repeat):
+    from downloader import stream_downloads, tune_session
+    from local_server import StandInServer
+
+    paths = dict(('/bench/{0}'.format(i), content) for i, content in enumerate(images))
+    with StandInServer(paths, delay=delay) as server:
+        jobs = [(server.url + path, None) for path in paths]
+
+        def run():
+            session = tune_session(requests.Session(), pool_size=workers)
+            return [stats for stats, _ in stream_downloads(jobs, session, workers=workers)]
+
+        elapsed, peak, stats = measure(run, repeat)
+    latencies = [s['latency'] for s in stats if s.get('latency') is not None]
+    return {
+        'seconds': elapsed,
+        'peak_bytes': peak,
+        'output_bytes': sum(s['bytes'] for s in stats),
+        'images': len(stats),
+        'mean_latency': sum(latencies) / len(latencies) if latencies else None,
+    }
+
+def timeline_case(images, delay, workers, repeat, page_size=12):
+    """Page through a stand-in timeline with iter_news_feed, downloading each post's image as it arrives"""
+    import start
+    from downloader import stream_downloads, tune_session
+    from local_server import StandInServer, make_feed_item, timeline_route
+
+    paths = dict(('/bench/{0}'.format(i), content) for i, content in enumerate(images))
+    with StandInServer(paths, delay=delay) as server:
+        items = [make_feed_item(str(i), server.url + path, taken_at=len(paths) - i) for i, path in enumerate(paths)]
+        pages = [items[i:i + page_size] for i in range(0, len(items), page_size)]
+        server.routes['/feed/'] = timeline_route(pages)
+        timeline_url, start.TIMELINE_URL = start.TIMELINE_URL, server.url + '/feed/'
+
+        def run():
+            session = tune_session(requests.Session(), pool_size=workers)
+            jobs = ((post.image_url, None) for post in start.iter_news_feed(session, max_posts=None))
+            return [stats for stats, _ in stream_downloads(jobs, session, workers=workers)]
+
+        try:
+            elapsed, peak, stats = measure(run, repeat)
+        finally:
+            start.TIMELINE_URL = timeline_url
+    return {
+        'seconds': elapsed,
+        'peak_bytes': peak,
+        'output_bytes': sum(s['bytes'] for s in stats),
+        'images': len(stats),
+        'pages': len(pages),
+    }
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(sizes, repeat, delay, workers):
+    results = {}
+    for size in sizes:
+        for kind in CONTENT_TYPES:
+            pixels, fmt = make_content(kind, size)
+            content = encode(pixels, fmt)
+            for name, result in render_cases(content, repeat):
+                results['{0}/{1}/{2}'.format(name, kind, size)] = result
+    images = [encode(*make_content('photo', 640, seed)) for seed in range(16)]
+    results['download/photo/640x16'] = download_case(images, delay, workers, repeat)
+    # same images, reached by paging through the timeline (4 pages) instead of a known list
+    results['timeline/photo/640x48'] = timeline_case(images * 3, delay, workers, repeat)
+    return results
+
+def print_table(results, baseline=None):
+    print('{0:<44} {1:>10} {2:>12} {3:>12}{4}'.format('case', 'ms', 'peak KB', 'out bytes', '   vs baseline' if baseline else ''))
+    for name, result in results.items():
+        line = '{0:<44} {1:>10.2f} {2:>12.1f} {3:>12}'.format(name, result['seconds'] * 1000, result['peak_bytes'] / 1024.0, result['output_bytes'])
+        if baseline and name in baseline and baseline[name]['seconds']:
+            line += '   {0:>6.2f}x'.format(result['seconds'] / baseline[name]['seconds'])
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark rendering and downloading offline')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help='Image sizes (square) to benchmark')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per case - the best time is reported')
+    parser.add_argument('--columns', type=int, default=100, help='Terminal columns to render for')
+    parser.add_argument('--rows', type=int, default=50, help='Terminal rows to render for')
+    parser.add_argument('--delay', type=float, default=0.05, help='Stand-in server delay per image in seconds')
+    parser.add_argument('--workers', type=int, default=8, help='Concurrent downloads')
+    parser.add_argument('--output', help='Write results to this JSON file')
+    parser.add_argument('--compare', help='Earlier JSON results to compare against')
+    args = parser.parse_args()
+
+    # Fixed terminal size so results don't depend on the window the benchmark runs in
+    os.environ['COLUMNS'], os.environ['LINES'] = str(args.columns), str(args.rows)
+
+    results = run(args.sizes, args.repeat, args.delay, args.workers)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    print_table(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'commit': git_commit(), 'time': time.time(), 'columns': args.columns, 'rows': args.rows,
+                       'results': results}, f, indent=1)
+
+if __name__ == '__main__':
+    main()
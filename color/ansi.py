@@ -1,4 +1,5 @@
-from color.graphics_util import alpha_blend
+import numpy as np
+from color.graphics_util import alpha_blend, alpha_blend_array
 
 
 def getANSIcolor_for_rgb(rgb):
@@ -15,6 +16,19 @@ def getANSIcolor_for_rgb(rgb):
     return int(((websafe_r * 36) + (websafe_g * 6) + websafe_b) + 16)
 
 
+# The 216 color cube is separable per channel, so the lookup table for a whole RGB cube is
+# the sum of three 256 entry tables. Values match getANSIcolor_for_rgb exactly (both round half to even).
+_WEBSAFE_LUT = np.array([int(round((v / 255.0) * 5)) for v in range(256)], dtype=np.int16)
+ANSI_CUBE_LUT_R = _WEBSAFE_LUT * 36 + 16
+ANSI_CUBE_LUT_G = _WEBSAFE_LUT * 6
+ANSI_CUBE_LUT_B = _WEBSAFE_LUT
+
+
+def getANSIcolors_for_rgb_array(rgb):
+    "Vectorized getANSIcolor_for_rgb - takes an (..., 3+) uint8 array and returns an int16 array of ANSI colors"
+    return ANSI_CUBE_LUT_R[rgb[..., 0]] + ANSI_CUBE_LUT_G[rgb[..., 1]] + ANSI_CUBE_LUT_B[rgb[..., 2]]
+
+
 def getANSIfgarray_for_ANSIcolor(ANSIcolor):
     "Return array of color codes to be used in composing an SGR escape sequence. Using array form lets us compose multiple color updates without putting out additional escapes"
     # We are using "256 color mode" which is available in xterm but not necessarily all terminals
@@ -60,7 +74,30 @@ def generate_ANSI_to_set_fg_bg_colors(cur_fg_color, cur_bg_color, new_fg_color,
         return ""
 
 
-def generate_optimized_y_move_down_x_SOL(y_dist):
+# Output optimization levels. Level 0 output is what terminals have always been given. Higher levels
+# produce the same screen with fewer bytes but rely on more terminal features.
+OPTIMIZE_NONE = 0       # baseline output
+OPTIMIZE_SAFE = 1       # REP for runs, default (1) params dropped, \r and \b for short moves - xterm, VTE, kitty, iTerm2...
+OPTIMIZE_BCE = 2        # also ECH for runs at end of line - needs BCE (Background Color Erase) support
+
+
+def generate_CSI(n, final, optimize = OPTIMIZE_NONE):
+    "Return a CSI sequence with numeric param n, dropping the param when it is the default (1) and optimizing"
+    if optimize and n == 1:
+        return "\x1b[" + final
+    return "\x1b[{0}{1}".format(n, final)
+
+
+def generate_ANSI_run(draw_char, count, optimize = OPTIMIZE_NONE):
+    "Return draw_char repeated count times, using REP (repeat preceding character) when that is shorter"
+    if optimize and count > 2:
+        rep = draw_char + generate_CSI(count - 1, "b", optimize)
+        if len(rep) < count:
+            return rep
+    return draw_char * count
+
+
+def generate_optimized_y_move_down_x_SOL(y_dist, optimize = OPTIMIZE_NONE):
     """ move down y_dist, set x=0 """
 
     # Optimization to move N lines and go to SOL in one command. Note that some terminals
@@ -71,7 +108,7 @@ def generate_optimized_y_move_down_x_SOL(y_dist):
     # want it in a different place and we don't want to output two x moves. Could pass in
     # desired x, or return current x from here.
 
-    string = "\x1b[{0}E".format(y_dist)  # ANSI code to move down N lines and move x to SOL
+    string = generate_CSI(y_dist, "E", optimize)  # ANSI code to move down N lines and move x to SOL
 
     # Would a sequence of 1 or more \n chars be cheaper? If so we'll output that instead
     if y_dist < len(string):
@@ -80,12 +117,15 @@ def generate_optimized_y_move_down_x_SOL(y_dist):
     return string
 
 
-def generate_ANSI_to_move_cursor(cur_x, cur_y, target_x, target_y):
+def generate_ANSI_to_move_cursor(cur_x, cur_y, target_x, target_y, optimize = OPTIMIZE_NONE):
     """
         Note that x positions are absolute (0=SOL) while y positions are relative. That is,
         we move the y position the relative distance between cur_y and target_y. It doesn't
         mean that cur_y=0 means we are on the first line of the screen. We have no way of
         knowing how tall the screen is, etc. at draw-time so we can't know this.
+
+        With optimize, the cheapest of the equivalent moves is picked (e.g. \r rather than
+        ESC[nD to get to SOL, \b for short moves left, no param for moves of 1).
     """
 
 
@@ -110,30 +150,30 @@ def generate_ANSI_to_move_cursor(cur_x, cur_y, target_x, target_y):
                 # Already in correct x position which is NOT SOL. Just output code to move cursor
                 # down. No special optimization is possible since \n would take us to SOL and then
                 # we'd also need to output a move for x.
-                return "\x1b[{0}B".format(y_dist)  # ANSI code to move down N lines
+                return generate_CSI(y_dist, "B", optimize)  # ANSI code to move down N lines
             else:
                 # Already in correct x position which is SOL. Output efficient code to move down.
-                return generate_optimized_y_move_down_x_SOL(y_dist)
+                return generate_optimized_y_move_down_x_SOL(y_dist, optimize)
         else:
 
             # Need to move in x and y
             if target_x != 0:
                 # x move is going to be required so we'll move y efficiently and as a side
                 # effect, x will become 0. Code below will move x to the right place
-                string += generate_optimized_y_move_down_x_SOL(y_dist)
+                string += generate_optimized_y_move_down_x_SOL(y_dist, optimize)
                 cur_x = 0
             else:
                 # Output move down that brings x to SOL. Then we're done.
-                return generate_optimized_y_move_down_x_SOL(y_dist)
+                return generate_optimized_y_move_down_x_SOL(y_dist, optimize)
 
     elif cur_y > target_y:  # MOVE UP
         if target_x == 0:
             # We want to move up and be at the SOL. That can be achieved with one command so we're
             # done and we return it. However note that some terminals may not support this so we
             # might have to remove this optimization or make it optional if that winds up mattering for terminals we care about.
-            return "\x1b[{0}F".format(cur_y - target_y)     # ANSI code to move up N lines and move x to SOL
+            return generate_CSI(cur_y - target_y, "F", optimize)     # ANSI code to move up N lines and move x to SOL
         else:
-            string += "\x1b[{0}A".format(cur_y - target_y)  # ANSI code to move up N lines
+            string += generate_CSI(cur_y - target_y, "A", optimize)  # ANSI code to move up N lines
 
     if cur_x < target_x:    # MOVE RIGHT
         # **SIZE - Note that when the bgcolor is specified (not None) and not overdrawing another drawing (as in an animation case)
@@ -141,13 +181,18 @@ def generate_ANSI_to_move_cursor(cur_x, cur_y, target_x, target_y):
         # size when advancing less than 3 columns since the min escape sequence here is len 4. Not implementing this now
         # \t (tab) could also be a cheap way to move forward, but not clear we can determine how far it goes or if that would
         # be consistent, nor whether it is ever destructive.
-        string += "\x1b[{0}C".format(target_x - cur_x)  # ANSI code to move cursor right N columns
+        string += generate_CSI(target_x - cur_x, "C", optimize)  # ANSI code to move cursor right N columns
     elif cur_x > target_x:  # MOVE LEFT
         # **SIZE - potential optimizations: \b (backspace) could be a cheaper way to move backwards when there is only a short
         # way to go. However, not sure if it is ever destructive so not bothering with it now.
         # If we need to move to x=0, \r could be a cheap way to get there. However not entirely clear whether some terminals
         # will move to next line as well, and might sometimes be destructive. Not going to research this so not doing it now.
-        string += "\x1b[{0}D".format(cur_x - target_x)  # ANSI code to move cursor left N columns
+        if optimize and target_x == 0:
+            string += "\r"                     # carriage return - 1 byte to SOL
+        elif optimize and cur_x - target_x <= 2:
+            string += "\b" * (cur_x - target_x)  # backspace is non-destructive on the terminals OPTIMIZE_SAFE targets
+        else:
+            string += generate_CSI(cur_x - target_x, "D", optimize)  # ANSI code to move cursor left N columns
 
     return string
 
@@ -179,6 +224,8 @@ def generate_ANSI_from_pixels(pixels, width, height, bgcolor_rgba, current_ansi_
        since x is reset for each line. Use the x_offset param instead.
     :param get_pixel_func: Optional function that allows using custom "pixel" formats. If not None, function
        that will be passed pixels and a current x,y value and must return character to draw and RGBA to draw it in.
+       It may also return a third element, the RGBA to use as the background of a non-space character (e.g. for
+       half block glyphs that show two pixels per cell). None, or no third element, means use bgcolor_rgba.
     :param is_overdraw: if True, drawing code can assume that all lines are being drawn on lines that were already
        established in the terminal. This allows for optimizations (e.g. not needing to output \n to fill blank lines).
     :param x_offset: If not zero, allows drawing each line starting at a particular X offset. Useful if
@@ -230,7 +277,9 @@ def generate_ANSI_from_pixels(pixels, width, height, bgcolor_rgba, current_ansi_
     for h in range(height):
         for w in range(width):
 
-            draw_char, rgba = get_pixel_func(pixels, w, h)
+            pixel = get_pixel_func(pixels, w, h)
+            draw_char, rgba = pixel[0], pixel[1]
+            cell_bg_rgba = pixel[2] if len(pixel) > 2 else None
 
             # Handle fully or partially transparent pixels - but not if it is the special "erase" character (None)
             skip_pixel = False
@@ -240,6 +289,8 @@ def generate_ANSI_from_pixels(pixels, width, height, bgcolor_rgba, current_ansi_
                     skip_pixel = True       # skip any full transparent pixel. Note that we don't output a bgcolor space (in specified or default cases). Why? In overdraw mode, that would be wrong since whatever is already drawn should show through. In non-overdraw, assumption is that any line we're drawing on has already been filled with bgcolor so lets not do extra output. If this was an issue in practice, could make it an option.
                 elif alpha != 255 and bgcolor_rgba is not None:
                     rgba = alpha_blend(rgba, bgcolor_rgba)  # non-opaque so blend with specified bgcolor
+                if cell_bg_rgba is not None and cell_bg_rgba[3] != 255 and bgcolor_rgba is not None:
+                    cell_bg_rgba = alpha_blend(cell_bg_rgba, bgcolor_rgba)
 
             if not skip_pixel:
 
@@ -309,10 +360,11 @@ def generate_ANSI_from_pixels(pixels, width, height, bgcolor_rgba, current_ansi_
 
                     else:
                         # We're supposed to output a non-space character, so we're going to need to change the foreground color
-                        # and make sure the bg is set appropriately
-                        string += generate_ANSI_to_set_fg_bg_colors(prior_fg_color, prior_bg_color, color, bgcolor_ANSI)
+                        # and make sure the bg is set appropriately (the cell's own bg color if get_pixel_func gave one)
+                        cell_bg_ANSI = bgcolor_ANSI if cell_bg_rgba is None else getANSIcolor_for_rgb(cell_bg_rgba)
+                        string += generate_ANSI_to_set_fg_bg_colors(prior_fg_color, prior_bg_color, color, cell_bg_ANSI)
                         prior_fg_color = color
-                        prior_bg_color = bgcolor_ANSI
+                        prior_bg_color = cell_bg_ANSI
 
                     # Actually output the character
                     string += draw_char
@@ -357,6 +409,211 @@ def generate_ANSI_from_pixels(pixels, width, height, bgcolor_rgba, current_ansi_
     return string, {'fg': prior_fg_color, 'bg': prior_bg_color}, { 'x': cursor_x, 'y': cursor_y }
 
 
+
+def generate_ANSI_from_rgba_array(rgba, bgcolor_rgba, current_ansi_colors = None, current_cursor_pos = None, is_overdraw = False, x_offset = 0, optimize = OPTIMIZE_NONE):
+    """
+    Array based equivalent of generate_ANSI_from_pixels for the default (space per pixel) case
+
+    Quantizes the whole frame at once through the palette lookup tables and emits runs of equal
+    color in one go. Output is byte-identical to generate_ANSI_from_pixels given the same parameters.
+
+    :param rgba: numpy array of shape (height, width, 4) holding RGBA values (uint8)
+    :param bgcolor_rgba: see generate_ANSI_from_pixels
+    :param current_ansi_colors: see generate_ANSI_from_pixels
+    :param current_cursor_pos: see generate_ANSI_from_pixels
+    :param is_overdraw: see generate_ANSI_from_pixels
+    :param x_offset: see generate_ANSI_from_pixels
+    :param optimize: one of the OPTIMIZE_* levels. Above OPTIMIZE_NONE the output is no longer byte-identical
+       but draws the same screen (see color.terminal_model) with fewer bytes.
+
+    Returns the same tuple as generate_ANSI_from_pixels
+    """
+
+    colors, bgcolor_ANSI = quantize_rgba_array(rgba, bgcolor_rgba)
+    if not is_overdraw and bgcolor_ANSI is not None:
+        # a space in the bg color is already there on a freshly established line
+        colors[colors == bgcolor_ANSI] = SKIP_CELL
+    return generate_ANSI_from_color_array(colors, bgcolor_ANSI, current_ansi_colors, current_cursor_pos, is_overdraw, x_offset, optimize)
+
+
+# Special values in color arrays (real values are ANSI colors 16-231)
+SKIP_CELL = -1          # leave the cell as it is on screen
+ERASE_CELL = -2         # draw the cell in the background color (bgcolor, or the terminal default if None)
+
+
+def quantize_rgba_array(rgba, bgcolor_rgba):
+    """
+    Quantize an (h, w, 4) RGBA array to ANSI colors, blending partially transparent pixels with bgcolor_rgba
+
+    Returns (int16 array of ANSI colors with SKIP_CELL for fully transparent pixels, ANSI color of bgcolor_rgba or None)
+    """
+    rgba = np.asarray(rgba, dtype=np.uint8)
+    if bgcolor_rgba is not None:
+        bgcolor_ANSI = getANSIcolor_for_rgb(bgcolor_rgba)
+        # Blend non-opaque pixels with the specified bgcolor (fully transparent ones are skipped anyway)
+        alpha = rgba[..., 3]
+        partial = (alpha != 0) & (alpha != 255)
+        if partial.any():
+            rgba = rgba.copy()
+            rgba[partial] = alpha_blend_array(rgba[partial], bgcolor_rgba)
+    else:
+        bgcolor_ANSI = None
+    colors = getANSIcolors_for_rgb_array(rgba)
+    colors[rgba[..., 3] == 0] = SKIP_CELL
+    return colors, bgcolor_ANSI
+
+
+def generate_ANSI_from_color_array(colors, bgcolor_ANSI, current_ansi_colors = None, current_cursor_pos = None, is_overdraw = False, x_offset = 0, optimize = OPTIMIZE_NONE):
+    """
+    Generate ANSI codes drawing an (h, w) array of ANSI colors as background-colored spaces
+
+    Cells holding SKIP_CELL are not drawn, cells holding ERASE_CELL are drawn in bgcolor_ANSI (None meaning the
+    terminal default). Other params and the return value are as for generate_ANSI_from_rgba_array.
+    """
+    height, width = colors.shape[:2]
+
+    if bgcolor_ANSI is not None:
+        bgcolor_ANSI_string = getANSIbgstring_for_ANSIcolor(bgcolor_ANSI)
+    else:
+        bgcolor_ANSI_string = "\x1b[49m"
+
+    if current_ansi_colors is not None:
+        out = []
+        prior_fg_color = current_ansi_colors['fg']
+        prior_bg_color = current_ansi_colors['bg']
+    else:
+        out = ["\x1b[m" if optimize else "\x1b[0m"]
+        prior_fg_color = None
+        prior_bg_color = None
+
+    if current_cursor_pos is not None:
+        cursor_x = current_cursor_pos['x']
+        cursor_y = current_cursor_pos['y']
+    else:
+        cursor_x = 0
+        cursor_y = 0
+
+    # A \n follows every row but the last in non-overdraw mode, so a run reaching the end of such a row
+    # can be erased in place (ECH doesn't move the cursor, and \n sends it to SOL anyway)
+    erase_line_ends = optimize >= OPTIMIZE_BCE and not is_overdraw
+
+    for h in range(height):
+        row = colors[h]
+        if width:
+            # Start index of every run of equal color in the row
+            starts = np.flatnonzero(np.diff(row)) + 1
+            starts = np.concatenate(([0], starts)).tolist()
+            ends = starts[1:] + [width]
+            run_colors = row[starts].tolist()
+        else:
+            starts = ends = run_colors = []
+
+        for w, end, color in zip(starts, ends, run_colors):
+            if color == SKIP_CELL:
+                continue
+            if color == ERASE_CELL:
+                color = bgcolor_ANSI
+
+            ofsetted_w = x_offset + w
+            if (cursor_x != ofsetted_w) or (cursor_y != h):
+                out.append(generate_ANSI_to_move_cursor(cursor_x, cursor_y, ofsetted_w, h, optimize))
+                cursor_x = ofsetted_w
+                cursor_y = h
+
+            out.append(generate_ANSI_to_set_fg_bg_colors(prior_fg_color, prior_bg_color, prior_fg_color, color))
+            prior_bg_color = color
+            count = end - w
+            if erase_line_ends and end == width and (h + 1) != height:
+                erase = generate_CSI(count, "X", optimize)
+                if len(erase) < count:
+                    out.append(erase)
+                    continue
+            out.append(generate_ANSI_run(" ", count, optimize))
+            cursor_x += count
+
+        if (h + 1) != height and not is_overdraw:
+            if prior_bg_color != bgcolor_ANSI:
+                out.append(bgcolor_ANSI_string)
+                prior_bg_color = bgcolor_ANSI
+            if (cursor_y != h):
+                out.append(generate_ANSI_to_move_cursor(0, cursor_y, 0, h, optimize))
+                cursor_y = h
+            out.append("\n")
+            cursor_y += 1
+            cursor_x = 0
+
+    return "".join(out), {'fg': prior_fg_color, 'bg': prior_bg_color}, { 'x': cursor_x, 'y': cursor_y }
+
+
+
+def generate_ANSI_frame_diff(prev_rgba, next_rgba, bgcolor_rgba, current_ansi_colors = None, current_cursor_pos = None, x_offset = 0, optimize = OPTIMIZE_NONE):
+    """
+    Generate ANSI codes turning an already drawn frame into the next one, drawing only the cells that changed
+
+    Cells are compared after quantization, so changes too small to show up in the palette cost nothing. Cells
+    that become transparent are erased to bgcolor_rgba (or the terminal default). Drawing is done in overdraw
+    mode on the lines where prev_rgba was drawn - current_cursor_pos is relative to its top left, as returned by
+    the call that drew it.
+
+    :param prev_rgba: (h, w, 4) RGBA array currently on screen, or None to repaint every cell of next_rgba
+    :param next_rgba: (h, w, 4) RGBA array to show - must be the same shape as prev_rgba
+    Other params and the return value are as for generate_ANSI_from_rgba_array.
+    """
+    next_colors, bgcolor_ANSI = quantize_rgba_array(next_rgba, bgcolor_rgba)
+    if prev_rgba is None:
+        diff = next_colors
+        diff[diff == SKIP_CELL] = ERASE_CELL
+    else:
+        prev_colors, _ = quantize_rgba_array(prev_rgba, bgcolor_rgba)
+        if prev_colors.shape != next_colors.shape:
+            raise ValueError("Frames must be the same shape to diff them")
+        changed = prev_colors != next_colors
+        diff = np.where(changed, next_colors, SKIP_CELL).astype(next_colors.dtype)
+        diff[changed & (next_colors == SKIP_CELL)] = ERASE_CELL
+    return generate_ANSI_from_color_array(diff, bgcolor_ANSI, current_ansi_colors, current_cursor_pos, True, x_offset, optimize)
+
+
+class FrameDiffer:
+    """
+    Redraws frames in place, tracking what is on screen (frame, colors, cursor) between calls
+
+    The first frame is drawn normally (establishing its lines). Later frames of the same shape only output the
+    changed cells. A frame of a different shape (e.g. after a resize) clears from the top of the drawing to the
+    end of the screen and is drawn again. Assumes nothing else moves the cursor or changes colors between calls.
+    """
+
+    def __init__(self, bgcolor_rgba = None, x_offset = 0, optimize = OPTIMIZE_NONE):
+        self.bgcolor_rgba = bgcolor_rgba
+        self.x_offset = x_offset
+        self.optimize = optimize
+        self.frame = None
+        self.ansi_colors = None
+        self.cursor_pos = None
+
+    def draw(self, rgba):
+        rgba = np.array(rgba, dtype=np.uint8)
+        if self.frame is None:
+            string, self.ansi_colors, self.cursor_pos = generate_ANSI_from_rgba_array(
+                rgba, self.bgcolor_rgba, None, None, False, self.x_offset, self.optimize)
+        elif self.frame.shape != rgba.shape:
+            # Back to the top left and clear the old drawing in the bg color - the same state \n leaves new lines in
+            string = generate_ANSI_to_move_cursor(self.cursor_pos['x'], self.cursor_pos['y'], 0, 0, self.optimize)
+            if self.bgcolor_rgba is None:
+                bgcolor_ANSI = None
+                string += "\x1b[0m\x1b[J"
+            else:
+                bgcolor_ANSI = getANSIcolor_for_rgb(self.bgcolor_rgba)
+                string += "\x1b[0m" + getANSIbgstring_for_ANSIcolor(bgcolor_ANSI) + "\x1b[J"
+            redraw, self.ansi_colors, self.cursor_pos = generate_ANSI_from_rgba_array(
+                rgba, self.bgcolor_rgba, {'fg': None, 'bg': bgcolor_ANSI}, {'x': 0, 'y': 0}, False, self.x_offset, self.optimize)
+            string += redraw
+        else:
+            string, self.ansi_colors, self.cursor_pos = generate_ANSI_frame_diff(
+                self.frame, rgba, self.bgcolor_rgba, self.ansi_colors, self.cursor_pos, self.x_offset, self.optimize)
+        self.frame = rgba
+        return string
+
+
 """
 DESIGN NOTE (Global Optimization)
 
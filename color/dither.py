@@ -0,0 +1,94 @@
+"""
+Deterministic dithering for the braille threshold and the 216 color palette
+
+Ordered (Bayer) dithering adds a fixed, tiled threshold pattern and is fully vectorized. Floyd-Steinberg
+error diffusion is sequential along rows, but a pixel only depends on its left neighbour and the three
+pixels above it, so every pixel on the line x + 2 * y = t can be processed at once: a frame takes
+width + 2 * height numpy steps instead of width * height python ones.
+"""
+
+import numpy as np
+
+DITHER_BAYER = 'bayer'
+DITHER_FLOYD_STEINBERG = 'floyd-steinberg'
+DITHER_METHODS = (DITHER_BAYER, DITHER_FLOYD_STEINBERG)
+
+BAYER_SIZE = 8
+# Distance between the levels of the color cube as getANSIcolor_for_rgb quantizes it (0, 51, ... 255)
+PALETTE_STEP = 255 / 5.0
+
+
+def bayer_matrix(size=BAYER_SIZE):
+    """Return the size x size (a power of 2) Bayer threshold matrix, scaled to [-0.5, 0.5)"""
+    matrix = np.zeros((1, 1))
+    while matrix.shape[0] < size:
+        matrix = np.block([[4 * matrix, 4 * matrix + 2], [4 * matrix + 3, 4 * matrix + 1]])
+    return (matrix + 0.5) / matrix.size - 0.5
+
+
+def bayer_offsets(shape, size=BAYER_SIZE):
+    """The Bayer matrix tiled over a (height, width) shape"""
+    height, width = shape[:2]
+    reps = (height + size - 1) // size, (width + size - 1) // size
+    return np.tile(bayer_matrix(size), reps)[:height, :width]
+
+
+def error_diffusion(values, quantize):
+    """
+    Floyd-Steinberg dither values ((h, w) or (h, w, channels) floats) with the quantize function
+
+    quantize maps an array of pixel values to the nearest representable ones. Returns the quantized array.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    height, width = values.shape[:2]
+    # one spare column on each side and a spare row below take the error pushed off the edges
+    work = np.zeros((height + 1, width + 2) + values.shape[2:])
+    work[:height, 1:width + 1] = values
+    out = np.empty_like(values)
+    ys_all = np.arange(height)
+    for t in range(width + 2 * (height - 1)):
+        xs = t - 2 * ys_all
+        valid = (xs >= 0) & (xs < width)
+        ys, xs = ys_all[valid], xs[valid]
+        old = work[ys, xs + 1]
+        new = quantize(old)
+        out[ys, xs] = new
+        err = old - new
+        work[ys, xs + 2] += err * (7 / 16.0)
+        work[ys + 1, xs] += err * (3 / 16.0)
+        work[ys + 1, xs + 1] += err * (5 / 16.0)
+        work[ys + 1, xs + 2] += err * (1 / 16.0)
+    return out
+
+
+def threshold_dots(means, threshold, method):
+    """Return the (h, w) bool array of means above threshold, dithered with method"""
+    if method == DITHER_BAYER:
+        # spread the threshold over the full brightness range around it
+        return means + bayer_offsets(means.shape) * 255 > threshold
+    if method == DITHER_FLOYD_STEINBERG:
+        return error_diffusion(means, lambda v: np.where(v > threshold, 255.0, 0.0)) > 0
+    return means > threshold
+
+
+def quantize_palette(v):
+    return np.clip(np.round(v / PALETTE_STEP), 0, 5) * PALETTE_STEP
+
+
+def dither_rgba(rgba, method):
+    """
+    Dither the RGB channels of an (h, w, 4) uint8 array to the levels of the ANSI color cube
+
+    The result quantizes through getANSIcolors_for_rgb_array like any other frame; alpha is untouched.
+    """
+    if method not in DITHER_METHODS:
+        return rgba
+    rgba = np.array(rgba, dtype=np.uint8)
+    rgb = rgba[..., :3].astype(np.float64)
+    if method == DITHER_BAYER:
+        rgb = quantize_palette(rgb + bayer_offsets(rgb.shape)[..., None] * PALETTE_STEP)
+    else:
+        rgb = error_diffusion(rgb, quantize_palette)
+    # exact cube levels - rounding keeps 51 * n from landing a hair below it
+    rgba[..., :3] = np.round(rgb)
+    return rgba
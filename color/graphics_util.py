@@ -1,3 +1,6 @@
+import numpy as np
+
+
 def alpha_blend(src, dst):
     # Does not assume that dst is fully opaque
     # See https://en.wikipedia.org/wiki/Alpha_compositing - section on "Alpha Blending"
@@ -14,3 +17,18 @@ def alpha_blend(src, dst):
             int(result_alpha * 255)
         )
 
+
+
+def alpha_blend_array(src, dst):
+    # Same as alpha_blend but for an (..., 4) array of src pixels over a single dst color.
+    # Operations are kept in the same order as alpha_blend so results match it exactly.
+    src_multiplier = src[..., 3] / 255.0
+    dst_multiplier = (dst[3] / 255.0) * (1 - src_multiplier)
+    result_alpha = src_multiplier + dst_multiplier
+    safe_alpha = np.where(result_alpha == 0, 1.0, result_alpha)
+    out = np.empty(src.shape, dtype=np.uint8)
+    for c in range(3):
+        out[..., c] = ((src[..., c] * src_multiplier) + (dst[c] * dst_multiplier)) / safe_alpha
+    out[..., 3] = result_alpha * 255
+    out[result_alpha == 0] = 0      # special case to match alpha_blend's div by zero guard
+    return out
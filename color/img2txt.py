@@ -2,60 +2,64 @@
 # -*- coding: utf-8 -*-
 # Modified from https://github.com/hit9/img2txt/blob/gh-pages/img2txt.py
 
-import sys
 import color.ansi
-from PIL import Image
+import numpy as np
+from color.dither import dither_rgba
 from color.graphics_util import alpha_blend
 
-def load_and_resize_image(imgname, antialias, maxLen, aspectRatio):
+# Character cells are roughly twice as tall as they are wide, and posts look best squashed a bit more
+TARGET_ASPECT_RATIO = 0.3
+UPPER_HALF_BLOCK = '\u2580'
+LOWER_HALF_BLOCK = '\u2584'
 
-    if aspectRatio is None:
-        aspectRatio = 1.0
-
-    img = Image.open(imgname)
-
-    # force image to RGBA - deals with palettized images (e.g. gif) etc.
-    if img.mode != 'RGBA':
-        img = img.convert('RGBA')
-
-    # need to change the size of the image?
-    if maxLen is not None or aspectRatio != 1.0:
-
-        native_width, native_height = img.size
-
-        new_width = native_width
-        new_height = native_height
-
-        # First apply aspect ratio change (if any) - just need to adjust one axis
-        # so we'll do the height.
-        if aspectRatio != 1.0:
-            new_height = int(float(aspectRatio) * new_height)
+def img_to_ansi(img, optimize=color.ansi.OPTIMIZE_NONE, dither_method=None):
+    # get pixels
+    pixels = dither_rgba(np.asarray(img), dither_method)
+    return color.ansi.generate_ANSI_from_rgba_array(pixels, None, optimize=optimize)[0]
 
-        # Now isotropically resize up or down (preserving aspect ratio) such that
-        # longer side of image is maxLen
-        if maxLen is not None:
-            rate = float(maxLen) / max(new_width, new_height)
-            new_width = int(rate * new_width)
-            new_height = int(rate * new_height)
 
-        if native_width != new_width or native_height != new_height:
-            img = img.resize((new_width, new_height), Image.ANTIALIAS if antialias else Image.NEAREST)
+def img_to_halfblock(img, dither_method=None):
+    """
+    Render two pixels per cell with half block glyphs: one pixel is the fg color, the other the bg
 
-    return img
+    Goes through generate_ANSI_from_pixels' get_pixel_func hook, returning the cell bg as the third
+    element. Each cell uses whichever of the upper and lower half block keeps more of the colors
+    already set, so only the half that changes needs an escape sequence.
+    """
+    pixels = dither_rgba(np.asarray(img), dither_method)
+    if pixels.shape[0] % 2:
+        # pad with a transparent row so every cell has a bottom pixel
+        pixels = np.concatenate([pixels, np.zeros((1,) + pixels.shape[1:], dtype=pixels.dtype)])
+    top, bottom = pixels[0::2], pixels[1::2]
+    top_ansi = color.ansi.getANSIcolors_for_rgb_array(top).tolist()
+    bottom_ansi = color.ansi.getANSIcolors_for_rgb_array(bottom).tolist()
+    top, bottom = top.tolist(), bottom.tolist()
+    # The colors generate_ANSI_from_pixels has set so far, as ANSI colors (None is the default)
+    state = {'fg': None, 'bg': None}
 
+    def get_pixel(pixels, x, y):
+        if x == 0:
+            state['bg'] = None      # reset at every line end
+        upper, lower = top[y][x], bottom[y][x]
+        if upper[3] == 0 and lower[3] == 0:
+            return " ", upper
+        if upper[3] == 0:
+            state['fg'], state['bg'] = bottom_ansi[y][x], None
+            return LOWER_HALF_BLOCK, lower      # only the bottom half is visible
+        if lower[3] == 0:
+            state['fg'], state['bg'] = top_ansi[y][x], None
+            return UPPER_HALF_BLOCK, upper
+        up, low = top_ansi[y][x], bottom_ansi[y][x]
+        if up == low:
+            # Both halves quantize to the same color - a plain space is fewer bytes
+            state['bg'] = low
+            return " ", lower
+        upper_cost = (state['fg'] != up) + (state['bg'] != low)
+        lower_cost = (state['fg'] != low) + (state['bg'] != up)
+        if lower_cost < upper_cost:
+            state['fg'], state['bg'] = low, up
+            return LOWER_HALF_BLOCK, lower, upper
+        state['fg'], state['bg'] = up, low
+        return UPPER_HALF_BLOCK, upper, lower
 
-def draw_with_color(img_path, post_info):
-    maxLen, fontSize, target_aspect_ratio = 100.0, 7, 0.3
-    img = load_and_resize_image(img_path, None, maxLen, target_aspect_ratio)
-    # get pixels
-    pixel = img.load()
-    print('username: ' + post_info['username'])
-    print('\033[4m' + post_info['site_url'] + '\033[0m \n')
-    width, height = img.size
-    sys.stdout.write(
-        color.ansi.generate_ANSI_from_pixels(pixel, width, height, None)[0])
-    sys.stdout.write("\x1b[0m\n")
-    sys.stdout.flush()
-    print('Likes: ' + post_info['likes'])
-    print(post_info['caption'])
-    print('-------------------\n')
+    return color.ansi.generate_ANSI_from_pixels(None, len(top[0]), len(top), None, get_pixel_func=get_pixel)[0]
@@ -0,0 +1,222 @@
+"""
+Small terminal emulator model used to check that optimized ANSI output draws the same screen
+
+Only models what color.ansi and the viewer emit: printable characters, \n (with UNIX onlcr, so it also
+returns to SOL), \r, \b, cursor moves (CSI A/B/C/D/E/F and H), ECH (CSI X), ED (CSI J and 2J), EL (CSI K),
+REP (CSI b) and 256 color SGR (underline is accepted and ignored). New lines established by \n are filled
+with the current background color (BCE).
+
+    python3 -m color.terminal_model         # check random frames at every optimization level and frame diffs
+"""
+
+import re
+
+CSI_RE = re.compile(r'\x1b\[([0-9;]*)([A-Za-z])')
+
+
+class TerminalModel:
+
+    def __init__(self, width):
+        self.width = width
+        self.cells = {}             # (x, y) -> (char, fg, bg)
+        self.x = 0
+        self.y = 0
+        self.lines = 1              # number of lines established so far
+        self.fg = None
+        self.bg = None
+        self.last_char = None
+
+    def put(self, char):
+        if self.x < self.width:
+            self.cells[(self.x, self.y)] = (char, self.fg if char != ' ' else None, self.bg)
+        self.x += 1
+        self.last_char = char
+
+    def newline(self):
+        self.y += 1
+        self.x = 0
+        if self.y >= self.lines:
+            self.lines = self.y + 1
+            for x in range(self.width):
+                self.cells[(x, self.y)] = (' ', None, self.bg)
+
+    def sgr(self, params):
+        codes = [int(p) if p else 0 for p in params.split(';')] if params else [0]
+        i = 0
+        while i < len(codes):
+            code = codes[i]
+            if code == 0:
+                self.fg = self.bg = None
+            elif code == 39:
+                self.fg = None
+            elif code == 49:
+                self.bg = None
+            elif code in (4, 24):
+                pass                # underline on/off - not modelled
+            elif code in (38, 48) and codes[i + 1] == 5:
+                if code == 38:
+                    self.fg = codes[i + 2]
+                else:
+                    self.bg = codes[i + 2]
+                i += 2
+            else:
+                raise ValueError('unsupported SGR code {0}'.format(code))
+            i += 1
+
+    def csi(self, params, final):
+        if final == 'm':
+            self.sgr(params)
+            return
+        if final == 'H':
+            row, _, col = params.partition(';')
+            self.y, self.x = (int(row) if row else 1) - 1, (int(col) if col else 1) - 1
+            self.lines = max(self.lines, self.y + 1)
+            return
+        n = int(params) if params and final not in 'JK' else 1
+        if final == 'A':
+            self.y -= n
+        elif final == 'B':
+            self.y += n
+        elif final == 'C':
+            self.x += n
+        elif final == 'D':
+            self.x = max(0, self.x - n)
+        elif final == 'E':
+            for _ in range(n):
+                self.newline()
+        elif final == 'F':
+            self.y -= n
+            self.x = 0
+        elif final == 'X':
+            for x in range(self.x, min(self.x + n, self.width)):
+                self.cells[(x, self.y)] = (' ', None, self.bg)
+        elif final == 'K':
+            if params not in ('', '0'):
+                raise ValueError('unsupported EL param ' + params)
+            for x in range(self.x, self.width):
+                self.cells[(x, self.y)] = (' ', None, self.bg)
+        elif final == 'J':
+            if params not in ('', '0', '2'):
+                raise ValueError('unsupported ED param ' + params)
+            for y in range(0 if params == '2' else self.y, self.lines):
+                for x in range(self.x if y == self.y and params != '2' else 0, self.width):
+                    self.cells[(x, y)] = (' ', None, self.bg)
+        elif final == 'b':
+            for _ in range(n):
+                self.put(self.last_char)
+        else:
+            raise ValueError('unsupported CSI final byte ' + final)
+
+    def feed(self, string):
+        pos = 0
+        while pos < len(string):
+            char = string[pos]
+            if char == '\x1b':
+                match = CSI_RE.match(string, pos)
+                if match is None:
+                    raise ValueError('unsupported escape at {0}: {1!r}'.format(pos, string[pos:pos + 10]))
+                self.csi(match.group(1), match.group(2))
+                pos = match.end()
+                continue
+            if char == '\n':
+                self.newline()
+            elif char == '\r':
+                self.x = 0
+            elif char == '\b':
+                self.x = max(0, self.x - 1)
+            else:
+                self.put(char)
+            pos += 1
+        return self
+
+    def screen(self):
+        """Return the drawn cells as a list of rows of (char, fg, bg)"""
+        return [[self.cells.get((x, y), (' ', None, None)) for x in range(self.width)] for y in range(self.lines)]
+
+
+def same_screen(baseline, optimized, width):
+    """True if both ANSI strings draw the same screen on a terminal width columns wide"""
+    return TerminalModel(width).feed(baseline).screen() == TerminalModel(width).feed(optimized).screen()
+
+
+def check_random_frames(count=200, seed=0):
+    """Compare every optimization level against the baseline on random frames. Returns the byte totals per level"""
+    import numpy as np
+    import color.ansi as ansi
+
+    rng = np.random.default_rng(seed)
+    levels = (ansi.OPTIMIZE_NONE, ansi.OPTIMIZE_SAFE, ansi.OPTIMIZE_BCE)
+    totals = dict((level, 0) for level in levels)
+    for i in range(count):
+        height, width = rng.integers(1, 20), rng.integers(1, 40)
+        palette = rng.integers(0, 256, (rng.integers(1, 6), 4)).astype(np.uint8)
+        palette[:, 3] = rng.choice([0, 255, 255, 255, 128], len(palette))
+        frame = palette[rng.integers(0, len(palette), (height, width))]
+        bgcolor = None if i % 2 else tuple(int(v) for v in rng.integers(0, 256, 3)) + (255,)
+        is_overdraw = i % 3 == 0
+        baseline = ansi.generate_ANSI_from_rgba_array(frame, bgcolor, is_overdraw=is_overdraw)[0]
+        totals[ansi.OPTIMIZE_NONE] += len(baseline)
+        for level in levels[1:]:
+            optimized = ansi.generate_ANSI_from_rgba_array(frame, bgcolor, is_overdraw=is_overdraw, optimize=level)[0]
+            if not same_screen(baseline, optimized, width + 1):
+                raise AssertionError('level {0} draws a different screen for frame {1}'.format(level, i))
+            totals[level] += len(optimized)
+    return totals
+
+
+def check_frame_diffs(count=200, seed=0):
+    """
+    Check that FrameDiffer redraws leave the same screen as repainting every cell of the new frame.
+    Returns (bytes of full repaints, bytes of diffs)
+    """
+    import numpy as np
+    import color.ansi as ansi
+
+    rng = np.random.default_rng(seed)
+    full_bytes = diff_bytes = 0
+    for i in range(count):
+        height, width = rng.integers(1, 12), rng.integers(1, 30)
+        palette = rng.integers(0, 256, (4, 4)).astype(np.uint8)
+        palette[:, 3] = [0, 255, 255, 255]
+        palette[1] = (0, 0, 0, 255)        # the bg color used below
+        prev = palette[rng.integers(0, 4, (height, width))]
+        # next frame: mostly the same, a few changed cells
+        changes = rng.random((height, width)) < 0.1
+        nxt = np.where(changes[..., None], palette[rng.integers(0, 4, (height, width))], prev)
+        if i % 10 == 0:
+            nxt = palette[rng.integers(0, 4, (height + 2, width))]      # resize
+        bgcolor = None if i % 2 else (0, 0, 0, 255)
+        optimize = i % 3
+
+        differ = ansi.FrameDiffer(bgcolor, optimize=optimize)
+        first = differ.draw(prev)
+        differ_colors, differ_cursor = dict(differ.ansi_colors), dict(differ.cursor_pos)
+        redraw = differ.draw(nxt)
+        # Like generate_ANSI_from_rgba_array, assume the line the drawing starts on is already filled with the bg color
+        bg = '' if bgcolor is None else ansi.getANSIbgstring_for_ANSIcolor(ansi.getANSIcolor_for_rgb(bgcolor))
+        first = bg + '\x1b[J' + first
+        terminal = TerminalModel(width + 1).feed(first).feed(redraw)
+
+        if nxt.shape != prev.shape:
+            # A resize clears to the bg color and draws the new frame normally
+            fresh = ansi.generate_ANSI_from_rgba_array(nxt, bgcolor, {'fg': None, 'bg': None if bgcolor is None else 16}, None)[0]
+            expected = TerminalModel(width + 1).feed(bg + '\x1b[J' + fresh).screen()
+            if terminal.screen()[:len(expected)] != expected:
+                raise AssertionError('resize redraw differs for frame {0}'.format(i))
+            continue
+
+        # Otherwise it must match repainting every cell, starting from where the first draw left the cursor
+        full, _, _ = ansi.generate_ANSI_frame_diff(None, nxt, bgcolor, differ_colors, differ_cursor)
+        reference = TerminalModel(width + 1).feed(first).feed(full)
+        if terminal.screen() != reference.screen():
+            raise AssertionError('frame diff draws a different screen for frame {0}'.format(i))
+        full_bytes += len(full)
+        diff_bytes += len(redraw)
+    return full_bytes, diff_bytes
+
+
+if __name__ == '__main__':
+    for level, total in sorted(check_random_frames().items()):
+        print('level {0}: {1} bytes'.format(level, total))
+    full_bytes, diff_bytes = check_frame_diffs()
+    print('frame diffs: {0} bytes vs {1} bytes for full repaints'.format(diff_bytes, full_bytes))
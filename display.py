@@ -1,63 +1,295 @@
 # Modified from https://github.com/nilesr/braille-art
 
+import multiprocessing
+import numpy as np
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
 from PIL import Image
-from color.img2txt import draw_with_color
-import os, random, sys
-import subprocess
+from color.img2txt import TARGET_ASPECT_RATIO, img_to_ansi, img_to_halfblock
+from color.ansi import generate_ANSI_from_pixels
+from color.dither import dither_rgba, threshold_dots
+from image_loader import load_image, terminal_size
+from render_cache import render_key
+import profiler
+import sys
 import time
 
-def img_average(x1, y1, x2, y2, img):
-    average = lambda x: sum(x)/len(x) if len(x) > 0 else 0
-    ret = []
-    for x in range(x1, x2):
-        for y in range(y1, y2):
-            ret.append(average(img.getpixel((x, y))[:3]))
-    return average(ret)
-
-def convert_index(x):
-    if x <  3: return x
-    if x == 3: return 6
-    if x == 4: return 3
-    if x == 5: return 4
-    if x == 6: return 5
-    if x == 7: return 7
-
-def draw(img_path, post_info):
-    img = Image.open(img_path)
-    start = 0x2800
-    char_width = 10
+# Braille dot weights laid out as [row][column] of the 2x4 dot grid of a cell
+# (U+2800 + sum of the weights of the raised dots)
+BRAILLE_BITS = np.array([[0x01, 0x08],
+                         [0x02, 0x10],
+                         [0x04, 0x20],
+                         [0x40, 0x80]], dtype=np.uint32)
+BRAILLE_START = 0x2800
+# Brightness range (0-255) below which a color braille cell is drawn as a full glyph
+FLAT_CELL_CONTRAST = 24
+# Color braille cells within this (per channel, 0-255) of the current fg color reuse it - less than
+# one step of the 6 level color cube, and it saves about a third of the escape sequences
+FG_TOLERANCE = 32
+
+# Lines used by the username/url header and likes/caption footer around each image
+RESERVED_LINES = 6
+
+def block_means(img, char_width):
+    """Return the mean brightness of every braille sub-cell as a (rows * 4, cols * 2) array"""
     char_height = char_width * 2
-    dither, sensitivity = 5, 0.6
-    char_width_divided, char_height_divided = round(char_width / 2), round(char_height / 4)
-    match = lambda a, b: a < b if "--invert" in sys.argv else a > b
-    print('username: ' + post_info['username'])
-    print('\033[4m' + post_info['site_url'] + '\033[0m \n')
-    image = ""
-    for y in range(0, img.height - char_height - 1, char_height):
-        for x in range(0, img.width - char_width - 1, char_width):
-            byte, index = 0x0, 0
-            for xn in range(2):
-                for yn in range(4):
-                    avg = img_average(x + (char_height_divided * xn), y + (char_width_divided * yn), x + (char_height_divided * (xn + 1)), y + (char_width_divided * (yn + 1)), img)
-                    if match(avg + random.randint(-dither, dither), sensitivity * 0xFF):
-                        byte += 2**convert_index(index)
-                    index += 1
-            image += chr(start + byte)
-        image += '\n'
-    print(image)
-    print('Likes: ' + post_info['likes'])
-    print(post_info['caption'])
-    print('-------------------\n')
-
-def display_to_terminal(posts_info, display_color):
-    file_list = os.listdir('./images/')
-    for filename in file_list:
-        img_path = './images/' + filename
-        if display_color:
-            draw_with_color(img_path, posts_info[filename])
-            time.sleep(2)
+    sub_width, sub_height = round(char_width / 2), round(char_height / 4)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    gray = np.asarray(img, dtype=np.float64).mean(axis=2)
+    rows, cols = img.height // char_height, img.width // char_width
+    gray = gray[:rows * 4 * sub_height, :cols * 2 * sub_width]
+    return gray.reshape(rows * 4, sub_height, cols * 2, sub_width).mean(axis=(1, 3))
+
+def braille_dots(means, invert=False, dither=5, sensitivity=0.6, seed=None, dither_method=None):
+    """
+    Threshold the sub-cell means into a bool array of raised dots
+
+    The dither noise is drawn from a generator seeded with seed, so the output is reproducible
+    (and cacheable). seed=None draws fresh noise every time. dither_method (see color.dither)
+    replaces the noise with ordered or error diffusion dithering.
+    """
+    threshold = sensitivity * 0xFF
+    if dither_method:
+        dots = threshold_dots(means, threshold, dither_method)
+        return ~dots if invert else dots
+    if dither:
+        rng = np.random.default_rng(seed)
+        means = means + rng.integers(-dither, dither + 1, size=means.shape)
+    return means < threshold if invert else means > threshold
+
+def braille_codes(dots):
+    """Pack each 2x4 group of dots into the offset of its braille glyph, as a (rows, cols) array"""
+    rows, cols = dots.shape[0] // 4, dots.shape[1] // 2
+    dots = dots.reshape(rows, 4, cols, 2)
+    return (dots * BRAILLE_BITS[None, :, None, :]).sum(axis=(1, 3), dtype=np.uint32)
+
+def braille_from_means(means, invert=False, dither=5, sensitivity=0.6, seed=None, dither_method=None):
+    """Threshold the sub-cell means and pack each 2x4 group into one braille glyph"""
+    codes = braille_codes(braille_dots(means, invert, dither, sensitivity, seed, dither_method))
+    rows, cols = codes.shape
+    out = np.full((rows, cols + 1), ord('\n'), dtype='<u4')
+    out[:, :cols] = codes + BRAILLE_START
+    return out.tobytes().decode('utf-32-le')
+
+def img_to_braille(img, char_width=10, invert=False, dither=5, sensitivity=0.6, seed=None, dither_method=None):
+    return braille_from_means(block_means(img, char_width), invert, dither, sensitivity, seed, dither_method)
+
+def img_to_color_braille(img, char_width=2, invert=False, dither_method=None):
+    """
+    Render braille glyphs whose foreground is the mean color of their raised dots
+
+    img has one RGBA pixel per dot (char_width must be 2). Each dot is raised if it is at least as
+    bright as the mean of its cell (at most as bright with invert), so the glyph shape carries the
+    detail inside the cell and the color carries its brightness. Cells with less contrast than
+    FLAT_CELL_CONTRAST are full glyphs. A cell close enough to the previous cell's color (see
+    FG_TOLERANCE) reuses it instead of paying for another escape sequence. dither_method dithers
+    the colors. Goes through generate_ANSI_from_pixels' get_pixel_func hook; transparent cells cost
+    no output.
+    """
+    means = block_means(img, char_width)
+    rows, cols = means.shape[0] // 4, means.shape[1] // 2
+    cells = means.reshape(rows, 4, cols, 2)
+    cell_means = cells.mean(axis=(1, 3), keepdims=True)
+    dots = (cells <= cell_means) if invert else (cells >= cell_means)
+    # below this contrast the shape would only draw jpeg noise
+    flat = np.ptp(cells, axis=(1, 3), keepdims=True) < FLAT_CELL_CONTRAST
+    dots = (dots | flat).reshape(means.shape)
+    rgba = np.asarray(img)[:means.shape[0], :means.shape[1]]
+    dots &= rgba[..., 3] != 0
+    codes = braille_codes(dots)
+    lit = dots.reshape(rows, 4, cols, 2, 1)
+    sums = (rgba[..., :3].reshape(rows, 4, cols, 2, 3) * lit).sum(axis=(1, 3), dtype=np.float64)
+    colors = np.full((rows, cols, 4), 255, dtype=np.uint8)
+    colors[..., :3] = np.round(sums / np.maximum(lit.sum(axis=(1, 3)), 1))
+    colors = dither_rgba(colors, dither_method)[..., :3]
+    glyphs = (codes + BRAILLE_START).tolist()
+    codes, colors = codes.tolist(), colors.tolist()
+    # the fg color generate_ANSI_from_pixels has set - kept while cells stay within FG_TOLERANCE of it
+    fg = [None]
+
+    def get_pixel(pixels, x, y):
+        if not codes[y][x]:
+            return ' ', (0, 0, 0, 0)
+        rgb = colors[y][x]
+        if fg[0] is None or max(abs(a - b) for a, b in zip(rgb, fg[0])) > FG_TOLERANCE:
+            fg[0] = rgb
+        return chr(glyphs[y][x]), fg[0] + [255]
+
+    return generate_ANSI_from_pixels(None, cols, rows, None, get_pixel_func=get_pixel)[0]
+
+# Render modes
+MODE_BRAILLE = 'braille'        # grayscale, 2x4 dots per cell
+MODE_ANSI = 'ansi'              # color, one pixel per cell
+MODE_HALFBLOCK = 'halfblock'    # color, two pixels per cell
+MODE_BRAILLE_COLOR = 'braille-color'    # color, 2x4 dots per cell
+MODES = (MODE_BRAILLE, MODE_ANSI, MODE_HALFBLOCK, MODE_BRAILLE_COLOR)
+
+# Options set from the command line (see start.main)
+RENDER_OPTIONS = {'invert': False, 'ansi_optimize': 0, 'dither': None}
+
+def braille_settings():
+    # Fixed dither seed so a given image always renders the same way
+    return {'char_width': 2, 'invert': RENDER_OPTIONS['invert'], 'dither': 5, 'sensitivity': 0.6, 'seed': 0}
+
+def dither_settings():
+    return {'dither_method': RENDER_OPTIONS['dither']} if RENDER_OPTIONS['dither'] else {}
+
+def load_braille_image(source):
+    """Decode source to one pixel per braille dot, sized to fit the terminal"""
+    return load_image(source, *render_box(MODE_BRAILLE))
+
+def load_color_image(source):
+    """Decode source to one pixel per character cell, sized to fit the terminal"""
+    return load_image(source, *render_box(MODE_ANSI), mode='RGBA', resample=Image.NEAREST)
+
+def load_halfblock_image(source):
+    """Decode source to one pixel per half character cell - same terminal space as load_color_image"""
+    return load_image(source, *render_box(MODE_HALFBLOCK), mode='RGBA', resample=Image.NEAREST)
+
+def load_braille_color_image(source):
+    return load_image(source, *render_box(MODE_BRAILLE_COLOR), mode='RGBA')
+
+def render_box(mode):
+    """Return (max width, max height, aspect ratio) that prepare_image fits images of this mode into"""
+    columns, rows = terminal_size()
+    lines = max(1, rows - RESERVED_LINES)
+    if mode == MODE_ANSI:
+        return columns - 1, lines, TARGET_ASPECT_RATIO
+    if mode == MODE_HALFBLOCK:
+        return columns - 1, lines * 2, TARGET_ASPECT_RATIO * 2
+    return (columns - 1) * 2, lines * 4, 1.0
+
+def render_settings(mode):
+    """Return the settings that, with the mode, identify how images are rendered"""
+    if mode == MODE_ANSI:
+        return dict({'optimize': RENDER_OPTIONS['ansi_optimize']}, **dither_settings())
+    if mode == MODE_HALFBLOCK:
+        return dither_settings()
+    if mode == MODE_BRAILLE_COLOR:
+        return dict({'char_width': 2, 'invert': RENDER_OPTIONS['invert']}, **dither_settings())
+    return dict(braille_settings(), **dither_settings())
+
+def render_image(img, mode, **settings):
+    """Render a prepared image to text - pure, so it can run in a worker process"""
+    if mode == MODE_ANSI:
+        return img_to_ansi(img, **settings) + '\x1b[0m\n'
+    if mode == MODE_HALFBLOCK:
+        return img_to_halfblock(img, **settings) + '\x1b[0m\n'
+    if mode == MODE_BRAILLE_COLOR:
+        return img_to_color_braille(img, **settings) + '\x1b[0m\n'
+    return img_to_braille(img, **settings) + '\n'
+
+def post_header(post_info):
+    page = ' [' + post_info['page'] + ']' if 'page' in post_info else ''
+    return ('username: ' + post_info['username'] + page + '\n' +
+            '\033[4m' + post_info['site_url'] + '\033[0m \n\n')
+
+def post_footer(post_info):
+    return ('Likes: ' + post_info['likes'] + '\n' +
+            post_info['caption'] + '\n' +
+            '-------------------\n\n')
+
+def format_post(post_info, body):
+    return post_header(post_info) + body + post_footer(post_info)
+
+def timed_render_image(img, mode, **settings):
+    """render_image that also returns how long it took - lets --profile see into worker processes"""
+    start = time.perf_counter()
+    body = render_image(img, mode, **settings)
+    return body, time.perf_counter() - start
+
+def render_post(img, post_info, mode, cache=None):
+    """Return the full text of a post: header, rendered image and footer"""
+    img = prepare_image(img, mode)
+    settings = render_settings(mode)
+    with profiler.stage('render', post_info['site_url']) as stage:
+        if cache is not None:
+            body = cache.render(img, mode, terminal_size()[0], settings, partial(render_image, mode=mode))
         else:
-            draw(img_path, posts_info[filename])
+            body = render_image(img, mode, **settings)
+        stage.bytes = len(body)
+    return format_post(post_info, body)
+
+def prepare_image(source, mode):
+    """Decode and size an image for the given render mode - safe to call from worker threads"""
+    if mode == MODE_ANSI:
+        return load_color_image(source)
+    if mode == MODE_HALFBLOCK:
+        return load_halfblock_image(source)
+    if mode == MODE_BRAILLE_COLOR:
+        return load_braille_color_image(source)
+    return load_braille_image(source)
+
+def render_pool(workers):
+    """
+    Process pool for rendering posts
+
+    Callers have download and prefetch threads running, and forking then can copy a lock another
+    thread holds into the worker - so workers come from a forkserver (or are spawned) instead.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context)
+
+def render_stream(posts, mode, cache=None, workers=1, pool=None):
+    """
+    Render (image, post_info) pairs, yielding (post_info, text of the post) in feed order
+
+    With workers > 1, cache misses are rendered in a process pool - pool if given (it is left
+    running), otherwise one made for this stream. At most 2 * workers posts are in flight, which
+    bounds the memory held for reordering.
+    """
+    settings = render_settings(mode)
+    width = terminal_size()[0]
+    if workers <= 1:
+        for img, post_info in posts:
+            yield post_info, render_post(img, post_info, mode, cache)
+        return
+
+    profiling = profiler.enabled()
+
+    def finish(job):
+        future, key, post_info, cached = job
+        body = future.result()
+        if not cached:
+            if profiling:
+                body, seconds = body
+                profiler.record('render', seconds, len(body), post_info['site_url'])
+            if key is not None:
+                cache.put(key, body)
+        return post_info, format_post(post_info, body)
+
+    pending = deque()
+    own_pool = pool is None
+    if own_pool:
+        pool = render_pool(workers)
+    try:
+        for img, post_info in posts:
+            img = prepare_image(img, mode)
+            key = render_key(img, mode, width, settings) if cache is not None else None
+            body = cache.get(key) if key is not None else None
+            if body is not None:
+                future = Future()
+                future.set_result(body)
+            else:
+                future = pool.submit(timed_render_image if profiling else render_image, img, mode, **settings)
+            pending.append((future, key, post_info, body is not None))
+            if len(pending) >= workers * 2:
+                yield finish(pending.popleft())
+        while pending:
+            yield finish(pending.popleft())
+    finally:
+        if own_pool:
+            pool.shutdown()
 
-if __name__ == '__main__':
-    display_to_terminal(posts_info)
+def display_stream(posts, mode, cache=None, workers=1, on_post=None, pool=None):
+    """Render (image, post_info) pairs as they arrive, calling on_post(post_info, text) after each one"""
+    for post_info, text in render_stream(posts, mode, cache, workers, pool):
+        with profiler.stage('write') as stage:
+            sys.stdout.write(text)
+            sys.stdout.flush()
+            stage.bytes = len(text)
+        if on_post is not None:
+            on_post(post_info, text)
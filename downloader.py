@@ -0,0 +1,137 @@
+import itertools
+import threading
+import time
+from collections import deque
+from image_cache import cache_key
+import profiler
+from transport import RecordingAdapter, ReplayAdapter
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_WORKERS = 8
+DEFAULT_TIMEOUT = (5, 30)           # (connect, read) seconds
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.3
+CHUNK_SIZE = 64 * 1024
+WRITE_BUFFER = 256 * 1024
+
+class TokenBucket:
+    """Thread safe token bucket - allows `rate` requests per second with bursts of up to `capacity`"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+def tune_session(session, pool_size=DEFAULT_WORKERS, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF):
+    """
+    Mount a connection pool sized for pool_size concurrent downloads, retrying with backoff
+
+    Call it once per session: the adapters it replaces are closed, dropping their connections.
+    """
+    retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=(429, 500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    for prefix in ('https://', 'http://'):
+        current = session.adapters.get(prefix)
+        if isinstance(current, (RecordingAdapter, ReplayAdapter)):
+            # Keep recording or replaying - the transport sends through the tuned adapter instead
+            current.wrap(adapter)
+        else:
+            if current is not None:
+                current.close()
+            session.mount(prefix, adapter)
+    return session
+
+def download_image(session, url, path=None, timeout=DEFAULT_TIMEOUT, bucket=None, cache=None):
+    """
+    Stream url into path, or into memory if path is None
+
+    Returns a dict with the bytes written and latency in seconds. In memory downloads also have the
+    body under 'content'. If an ImageCache is given, hits are served from it without a request
+    ('cached' is True in the stats) and misses are added to it.
+    """
+    start = time.monotonic()
+    key = cache_key(url) if cache is not None else None
+    content = cache.get(key) if cache is not None else None
+    cached = content is not None
+
+    if not cached:
+        if bucket is not None:
+            bucket.acquire()
+        with session.get(url, timeout=timeout, stream=True) as res:
+            res.raise_for_status()
+            if path is not None and cache is None:
+                size = 0
+                with open(path, 'wb', buffering=WRITE_BUFFER) as f:
+                    for chunk in res.iter_content(chunk_size=CHUNK_SIZE):
+                        if chunk:
+                            f.write(chunk)
+                            size += len(chunk)
+                latency = time.monotonic() - start
+                profiler.record('download', latency, size, url, cached=False)
+                return {'url': url, 'path': path, 'bytes': size, 'cached': False, 'latency': latency}
+            content = res.content
+        if cache is not None:
+            cache.put(key, content)
+
+    stats = {'url': url, 'path': path, 'bytes': len(content), 'cached': cached}
+    if path is None:
+        stats['content'] = content
+    else:
+        with open(path, 'wb', buffering=WRITE_BUFFER) as f:
+            f.write(content)
+    stats['latency'] = time.monotonic() - start
+    profiler.record('download', stats['latency'], stats['bytes'], url, cached=cached)
+    return stats
+
+def stream_downloads(jobs, session, workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT, rate=None, prepare=None, window=None, cache=None):
+    """
+    Download (url, path) jobs with at most `workers` requests in flight, yielding results in job order
+
+    Each result is yielded as soon as it and every job before it are done, so consumers can start on the
+    first post while later ones are still downloading.
+
+    :param rate: optional limit on requests started per second
+    :param prepare: optional function called in the worker thread on the downloaded path, or on the
+       content for in memory (path None) jobs, e.g. to decode the image. Its return value is yielded
+       alongside the stats and the content is dropped from the stats.
+    :param window: max number of jobs submitted ahead of the consumer (defaults to 2 * workers)
+    :param cache: optional ImageCache to serve repeat images from
+    Yields (stats, prepared) tuples. Failed downloads have an 'error' entry in stats and prepared is None.
+    """
+    bucket = TokenBucket(rate) if rate else None
+    window = window or workers * 2
+
+    def fetch(job):
+        url, path = job
+        try:
+            stats = download_image(session, url, path, timeout, bucket, cache)
+            if prepare is None:
+                return stats, None
+            return stats, prepare(stats.pop('content') if path is None else path)
+        except Exception as e:
+            return {'url': url, 'path': path, 'bytes': 0, 'latency': None, 'error': str(e)}, None
+
+    jobs = iter(jobs)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque(pool.submit(fetch, job) for job in itertools.islice(jobs, window))
+        while pending:
+            result = pending.popleft().result()
+            for job in itertools.islice(jobs, 1):
+                pending.append(pool.submit(fetch, job))
+            yield result
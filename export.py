@@ -0,0 +1,166 @@
+"""
+Headless export of rendered posts to files, for use by other tools
+
+For each post, DIR gets NNNN_<media id>.braille (braille, as printed), NNNN_<media id>.ans (256 color
+ANSI, as printed) and NNNN_<media id>.txt (plain ASCII art, readable without braille fonts). Optionally
+feed.ans holds every ANSI post in feed order and feed.html shows them in a browser.
+"""
+
+import html
+import os
+from collections import deque
+import numpy as np
+from display import MODE_ANSI, MODE_BRAILLE, block_means, format_post, prepare_image, render_image, render_pool, render_settings
+from downloader import DEFAULT_WORKERS, WRITE_BUFFER, stream_downloads
+from color.terminal_model import CSI_RE, TerminalModel
+import profiler
+
+# format -> file suffix
+EXPORT_FORMATS = {'braille': '.braille', 'ansi': '.ans', 'txt': '.txt'}
+# Characters of the plain text version, darkest to brightest
+ASCII_RAMP = ' .:-=+*#%@'
+STREAM_FILE = 'feed.ans'
+HTML_FILE = 'feed.html'
+# xterm's levels for the 6x6x6 color cube (indices 16-231) and its 24 grays (232-255)
+CUBE_LEVELS = (0, 95, 135, 175, 215, 255)
+HTML_HEAD = ('<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>Instagram feed</title>\n'
+             '<style>body{background:#000;color:#ddd}pre{font:12px/1 monospace}</style></head><body>\n')
+HTML_TAIL = '</body></html>\n'
+
+def ansi_color_hex(index):
+    """CSS color of a 256 color palette index"""
+    if index >= 232:
+        level = 8 + (index - 232) * 10
+        r = g = b = level
+    elif index >= 16:
+        index -= 16
+        r, g, b = CUBE_LEVELS[index // 36], CUBE_LEVELS[index // 6 % 6], CUBE_LEVELS[index % 6]
+    else:
+        # the 16 system colors vary between terminals - use the cube equivalents
+        r, g, b = [255 * ((index >> bit) & 1) for bit in (0, 1, 2)]
+    return '#{0:02x}{1:02x}{2:02x}'.format(r, g, b)
+
+def ansi_to_html(body, width):
+    """Turn a color.ansi drawing into html spans, merging runs of equal colors"""
+    out = []
+    for row in TerminalModel(width).feed(body).screen():
+        line, run, style = [], [], None
+        for char, fg, bg in row:
+            cell_style = ''
+            if fg is not None:
+                cell_style += 'color:' + ansi_color_hex(fg) + ';'
+            if bg is not None:
+                cell_style += 'background:' + ansi_color_hex(bg) + ';'
+            if cell_style != style and run:
+                line.append(span(''.join(run), style))
+                run = []
+            style = cell_style
+            run.append(char)
+        if run:
+            line.append(span(''.join(run), style))
+        out.append(''.join(line).rstrip())
+    return '\n'.join(out).rstrip() + '\n'
+
+def span(text, style):
+    text = html.escape(text)
+    return '<span style="' + style + '">' + text + '</span>' if style else text
+
+def post_html(post_info, body, width):
+    return ('<pre>username: ' + html.escape(post_info['username']) + '\n' +
+            '<a href="' + html.escape(post_info['site_url']) + '">' + html.escape(post_info['site_url']) + '</a>\n\n' +
+            ansi_to_html(body, width) +
+            'Likes: ' + html.escape(post_info['likes']) + '\n' +
+            html.escape(post_info['caption']) + '</pre>\n<hr>\n')
+
+def img_to_ascii(img, char_width=2, invert=False, **_):
+    """Render a braille-sized image (one pixel per dot) as ASCII, one character per 2x4 dots"""
+    means = block_means(img, char_width)
+    rows, cols = means.shape[0] // 4, means.shape[1] // 2
+    cells = means.reshape(rows, 4, cols, 2).mean(axis=(1, 3))
+    if invert:
+        cells = 255 - cells
+    levels = np.minimum((cells * len(ASCII_RAMP) / 256).astype(int), len(ASCII_RAMP) - 1)
+    return ''.join(''.join(ASCII_RAMP[level] for level in row) + '\n' for row in levels.tolist())
+
+def export_post(content, post_info, name, directory, settings, stream, want_html):
+    """
+    Render one post in every export format and write its files (runs in a worker process)
+
+    Returns (ANSI post text if stream, html if want_html, bytes written) for the concatenated outputs.
+    """
+    imgs = dict((mode, prepare_image(content, mode)) for mode in (MODE_BRAILLE, MODE_ANSI))
+    bodies = {'braille': render_image(imgs[MODE_BRAILLE], MODE_BRAILLE, **settings[MODE_BRAILLE]),
+              'ansi': render_image(imgs[MODE_ANSI], MODE_ANSI, **settings[MODE_ANSI]),
+              'txt': img_to_ascii(imgs[MODE_BRAILLE], **settings[MODE_BRAILLE])}
+    texts = {}
+    for fmt in EXPORT_FORMATS:
+        text = format_post(post_info, bodies[fmt])
+        if fmt == 'txt':
+            # format_post underlines the post url
+            text = CSI_RE.sub('', text)
+        texts[fmt] = text
+    written = 0
+    for fmt, text in texts.items():
+        data = text.encode('utf-8')
+        with open(os.path.join(directory, name + EXPORT_FORMATS[fmt]), 'wb') as f:
+            f.write(data)
+        written += len(data)
+    # one column per pixel of the ANSI image
+    page_html = post_html(post_info, bodies['ansi'], imgs[MODE_ANSI].width + 1) if want_html else None
+    return texts['ansi'] if stream else None, page_html, written
+
+def export_feed(posts, session, directory, workers=DEFAULT_WORKERS, render_workers=1, rate=None, cache=None,
+                stream=False, want_html=False):
+    """
+    Download and export (media id, post_info) pairs into directory, rendering in render_workers processes
+
+    Posts are rendered in parallel but feed.ans and feed.html are written in feed order, through
+    large buffers. Returns the number of posts exported.
+    """
+    os.makedirs(directory, exist_ok=True)
+    settings = dict((mode, render_settings(mode)) for mode in (MODE_BRAILLE, MODE_ANSI))
+    pending_info = deque()
+
+    def jobs():
+        for key, post_info in posts:
+            pending_info.append((key, post_info))
+            yield post_info['image_url'], None
+
+    stream_file = open(os.path.join(directory, STREAM_FILE), 'w', encoding='utf-8', buffering=WRITE_BUFFER) if stream else None
+    html_file = open(os.path.join(directory, HTML_FILE), 'w', encoding='utf-8', buffering=WRITE_BUFFER) if want_html else None
+    if html_file is not None:
+        html_file.write(HTML_HEAD)
+
+    def finish(future):
+        ansi_text, page_html, written = future.result()
+        with profiler.stage('write') as stage:
+            if stream_file is not None:
+                stream_file.write(ansi_text)
+            if html_file is not None:
+                html_file.write(page_html)
+            stage.bytes = written
+
+    count = 0
+    pending = deque()
+    try:
+        with render_pool(max(1, render_workers)) as pool:
+            for stats, _ in stream_downloads(jobs(), session, workers=workers, rate=rate, cache=cache):
+                key, post_info = pending_info.popleft()
+                if 'error' in stats:
+                    print('ERROR: could not download ' + post_info['image_url'] + ': ' + stats['error'])
+                    continue
+                count += 1
+                name = '{0:04d}_{1}'.format(count, key)
+                pending.append(pool.submit(export_post, stats['content'], post_info, name, directory, settings, stream, want_html))
+                # Bound the rendered posts waiting to be written in order
+                if len(pending) >= max(1, render_workers) * 2:
+                    finish(pending.popleft())
+            while pending:
+                finish(pending.popleft())
+    finally:
+        if stream_file is not None:
+            stream_file.close()
+        if html_file is not None:
+            html_file.write(HTML_TAIL)
+            html_file.close()
+    return count
@@ -0,0 +1,120 @@
+import json
+from collections import OrderedDict
+from image_cache import atomic_write
+
+DEFAULT_RETENTION = 1000
+SEEN_FILE = 'seen.json'
+MAX_SEEN = 10000
+SITE_URL = 'https://www.instagram.com/p/'
+
+class Post:
+    """One feed post - slots keep a long session with thousands of posts small"""
+    __slots__ = ('media_id', 'username', 'caption', 'image_urls', 'likes', 'code', 'taken_at')
+
+    def __init__(self, media_id, username, caption, image_urls, likes=0, code='', taken_at=0):
+        self.media_id = media_id
+        self.username = username
+        self.caption = caption
+        self.image_urls = tuple(image_urls)
+        self.likes = likes
+        self.code = code
+        self.taken_at = taken_at
+
+    @property
+    def image_url(self):
+        return self.image_urls[0]
+
+    @property
+    def site_url(self):
+        return SITE_URL + self.code + '/?taken-by=' + self.username
+
+    def info(self, page=0):
+        """Return the post_info dict the display functions take, for the given carousel page"""
+        info = {
+            'media_id': self.media_id,
+            'username': self.username,
+            'caption': self.caption,
+            'image_url': self.image_urls[page],
+            'likes': str(self.likes),
+            'site_url': self.site_url,
+        }
+        if len(self.image_urls) > 1:
+            info['page'] = str(page + 1) + '/' + str(len(self.image_urls))
+        return info
+
+    def __repr__(self):
+        return 'Post(' + repr(self.media_id) + ', ' + repr(self.username) + ')'
+
+class FeedStore:
+    """
+    Posts in feed order, indexed by media id
+
+    merge() adds a page of posts, skipping ones already held (their likes and caption are updated in
+    place). Only the max_posts most recently added posts are kept.
+    """
+    def __init__(self, max_posts=DEFAULT_RETENTION):
+        self.max_posts = max_posts
+        self.posts = OrderedDict()
+
+    def __len__(self):
+        return len(self.posts)
+
+    def __iter__(self):
+        return iter(self.posts.values())
+
+    def __contains__(self, media_id):
+        return media_id in self.posts
+
+    def get(self, media_id):
+        return self.posts.get(media_id)
+
+    def merge(self, posts):
+        """Add posts, returning the ones that were not already in the store"""
+        added = []
+        for post in posts:
+            known = self.posts.get(post.media_id)
+            if known is not None:
+                known.likes, known.caption = post.likes, post.caption
+                continue
+            self.posts[post.media_id] = post
+            added.append(post)
+        while self.max_posts is not None and len(self.posts) > self.max_posts:
+            self.posts.popitem(last=False)
+        return added
+
+class SeenIds:
+    """
+    Media ids already shown, persisted to path so a restarted --watch doesn't show them again
+
+    Only the max_ids most recent ids are kept - far more than a timeline ever goes back - so the
+    set (and the file) stay the same size over any uptime.
+    """
+    def __init__(self, path=SEEN_FILE, max_ids=MAX_SEEN):
+        self.path = path
+        self.max_ids = max_ids
+        self.ids = OrderedDict()
+        self.load()
+
+    def __contains__(self, media_id):
+        return media_id in self.ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, media_id):
+        self.ids[media_id] = None
+        self.ids.move_to_end(media_id)
+        while len(self.ids) > self.max_ids:
+            self.ids.popitem(last=False)
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                ids = json.load(f)
+        except (FileNotFoundError, ValueError):
+            ids = []
+        for media_id in ids:
+            self.add(media_id)
+
+    def save(self):
+        atomic_write(self.path, json.dumps(list(self.ids)).encode('utf-8'))
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+DEFAULT_CACHE_DIR = os.path.join('cache', 'images')
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+INDEX_FILE = 'index.json'
+# Query params that pick a different rendition of the same image, rather than sign the request
+KEPT_QUERY_PARAMS = ('stp',)
+
+def cache_key(url):
+    """
+    Identity of an image - the URL path, plus the stp (size/format) param if any
+
+    The same image is served from several CDN hosts (scontent-*) with per-request signing params,
+    so both are left out.
+    """
+    _, _, path, query, _ = urlsplit(url)
+    kept = [(name, value) for name, value in parse_qsl(query) if name in KEPT_QUERY_PARAMS]
+    return path + ('?' + urlencode(kept) if kept else '')
+
+def atomic_write(path, data):
+    """Write data to path through a temporary file so readers never see a partial file"""
+    tmp_path = '{0}.{1}.{2}.tmp'.format(path, os.getpid(), threading.get_ident())
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+class ImageCache:
+    """
+    Content-addressed on-disk image cache with LRU eviction
+
+    Files are named by the sha1 of their cache key. index.json holds [key, size, last access]
+    entries from least to most recently used, so startup is a single small json load.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()        # key -> (size, last access), oldest first
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.load()
+
+    def filename(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def load(self):
+        try:
+            with open(os.path.join(self.directory, INDEX_FILE)) as f:
+                entries = json.load(f)
+        except (FileNotFoundError, ValueError):
+            entries = []
+        for key, size, accessed in entries:
+            if os.path.exists(self.filename(key)):
+                self.entries[key] = (size, accessed)
+                self.total_bytes += size
+        # Drop files left behind by a run that didn't get to save its index
+        known = set(os.path.basename(self.filename(key)) for key in self.entries)
+        for name in os.listdir(self.directory):
+            if name != INDEX_FILE and name not in known:
+                os.remove(os.path.join(self.directory, name))
+        self.evict()
+
+    def save(self):
+        with self.lock:
+            entries = [[key, size, accessed] for key, (size, accessed) in self.entries.items()]
+        atomic_write(os.path.join(self.directory, INDEX_FILE), json.dumps(entries, separators=(',', ':')).encode('utf-8'))
+
+    def get(self, key):
+        """Return the cached bytes for key, or None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries[key] = (entry[0], time.time())
+            self.entries.move_to_end(key)
+            self.hits += 1
+        try:
+            with open(self.filename(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            with self.lock:
+                self.forget(key)
+            return None
+
+    def put(self, key, content):
+        atomic_write(self.filename(key), content)
+        with self.lock:
+            self.forget(key)
+            self.entries[key] = (len(content), time.time())
+            self.total_bytes += len(content)
+            self.evict()
+
+    def forget(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[0]
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes"""
+        while self.total_bytes > self.max_bytes and self.entries:
+            key, (size, _) = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(self.filename(key))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,51 @@
+import io
+import shutil
+from PIL import Image
+
+# Used when stdout is not a terminal - matches the old fixed 100 column output
+DEFAULT_TERMINAL_SIZE = (100, 50)
+
+def terminal_size():
+    """Return (columns, rows) of the current terminal"""
+    size = shutil.get_terminal_size(DEFAULT_TERMINAL_SIZE)
+    return size.columns, size.lines
+
+def open_image(source):
+    """Open an image lazily from a path, raw bytes, a file object or an already opened image"""
+    if isinstance(source, Image.Image):
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    return Image.open(source)
+
+def fit_size(width, height, max_width, max_height, aspect_ratio=1.0):
+    """
+    Scale (width, height) to the largest size that fits in max_width x max_height, preserving the
+    aspect ratio after height has been multiplied by aspect_ratio
+    """
+    height = height * aspect_ratio
+    rate = min(float(max_width) / width, float(max_height) / height)
+    return max(1, int(rate * width)), max(1, int(rate * height))
+
+def load_image(source, max_width, max_height, aspect_ratio=1.0, mode='RGB', resample=Image.BOX):
+    """
+    Decode source straight to a max_width x max_height sized image in the given mode
+
+    For JPEGs, draft mode lets the decoder do most of the downscaling (1/2, 1/4 or 1/8 scale DCT)
+    so the full resolution image is never materialized. Images already loaded with the same
+    arguments are returned as is.
+    """
+    img = open_image(source)
+    fit = (max_width, max_height, aspect_ratio, mode)
+    if img.info.get('fit') == fit:
+        return img
+    target = fit_size(img.width, img.height, max_width, max_height, aspect_ratio)
+    if img.format == 'JPEG' and img.size != target:
+        img.draft(mode, target)
+    if img.mode != mode:
+        img = img.convert(mode)
+    if img.size != target:
+        img = img.resize(target, resample)
+    img.load()
+    img.info['fit'] = fit
+    return img
@@ -0,0 +1,84 @@
+"""
+The last rendered feed, saved so the next start can show it before anything else happens
+
+Only the standard library is imported here: start.py shows the saved feed before it imports requests,
+numpy and PIL, and --offline exits right after.
+"""
+
+import json
+import os
+import shutil
+import sys
+from collections import OrderedDict
+
+LAST_FEED_FILE = os.path.join('cache', 'last_feed.json')
+# Command line flags that change which posts are shown or how they are rendered - a saved feed is only
+# reused with the same ones
+RENDER_FLAGS = ('--color', '--halfblock', '--braille-color', '--invert', '--ansi-optimize', '--dither', '--accounts')
+# Skip the saved feed for modes that don't print the feed as a stream (--watch prints only posts it hasn't
+# shown before, so it would print the saved ones twice)
+SKIP_FLAGS = ('-h', '--help', '--export', '--interactive', '--record', '--replay', '--watch')
+# Same as image_loader.DEFAULT_TERMINAL_SIZE (importing it would pull in PIL)
+DEFAULT_TERMINAL_SIZE = (100, 50)
+
+# media id -> text of the posts shown by show_saved, in feed order
+shown = OrderedDict()
+
+def render_options(argv):
+    """The RENDER_FLAGS in argv, with their values, in a canonical order"""
+    options = []
+    for i, arg in enumerate(argv):
+        name = arg.split('=', 1)[0]
+        if name not in RENDER_FLAGS:
+            continue
+        if '=' in arg or name in ('--color', '--halfblock', '--braille-color', '--invert'):
+            options.append(arg)
+        elif i + 1 < len(argv):
+            options.append(name + '=' + argv[i + 1])
+    return sorted(options)
+
+def terminal_size():
+    """[columns, rows] - images are sized from both (see display.render_box), as a list like json gives back"""
+    size = shutil.get_terminal_size(DEFAULT_TERMINAL_SIZE)
+    return [size.columns, size.lines]
+
+def load(path=LAST_FEED_FILE):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def save(posts, argv, path=LAST_FEED_FILE):
+    """Save posts (media id -> rendered text, in feed order) as the last feed for these render flags"""
+    data = load(path) or {}
+    data[' '.join(render_options(argv))] = {'size': terminal_size(),
+                                            'posts': [[media_id, text] for media_id, text in posts.items() if text]}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def show_saved(argv):
+    """
+    Print the last feed saved with the same render flags (one feed is kept per combination), if there is one
+
+    With --offline the saved feed is shown even if the terminal size changed, and the program
+    exits afterwards (with an error if there is nothing saved).
+    """
+    offline = '--offline' in argv
+    if not offline and any(arg.split('=', 1)[0] in SKIP_FLAGS for arg in argv):
+        return
+    feed = (load() or {}).get(' '.join(render_options(argv)))
+    if feed is None:
+        if offline:
+            print('ERROR: no saved feed for these options, run once while online first')
+            exit()
+        return
+    if offline or feed.get('size') == terminal_size():
+        sys.stdout.write(''.join(text for _, text in feed['posts']))
+        sys.stdout.flush()
+        shown.update((media_id, text) for media_id, text in feed['posts'])
+    if offline:
+        exit()
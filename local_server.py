@@ -0,0 +1,148 @@
+"""Local stand-in for the Instagram endpoints, for trying the tool out offline"""
+
+import io
+import json
+import threading
+import time
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+def make_image(width=640, height=640, seed=0):
+    """A JPEG of random pixels"""
+    from PIL import Image
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, format='JPEG')
+    return buf.getvalue()
+
+def make_feed_item(media_id, image_url, username='user', taken_at=0, carousel_urls=None):
+    """A timeline item with the fields start.parse_feed_items reads, a carousel if carousel_urls is given"""
+    item = {
+        'id': media_id,
+        'code': 'C' + str(media_id),
+        'taken_at': taken_at,
+        'user': {'username': username},
+        'caption': {'text': 'caption ' + str(media_id)},
+        'like_count': 1,
+        'image_versions2': {'candidates': [{'url': image_url, 'width': 640, 'height': 640}]},
+    }
+    if carousel_urls:
+        item['carousel_media'] = [{'id': str(media_id) + '_' + str(n), 'image_versions2': {'candidates': [{'url': url, 'width': 640, 'height': 640}]}}
+                                  for n, url in enumerate(carousel_urls)]
+    return item
+
+def json_response(body, status=200, headers=None):
+    return status, 'application/json', json.dumps(body).encode('utf-8'), headers or {}
+
+def request_cookies(request):
+    cookies = SimpleCookie(request['headers'].get('Cookie', ''))
+    return dict((name, morsel.value) for name, morsel in cookies.items())
+
+def timeline_route(pages, session_id=None):
+    """
+    Route serving pages (lists of items) through the next_max_id / more_available cursor
+
+    The cursor for page n is simply str(n). If session_id is given, requests without that
+    sessionid cookie are rejected like an expired session.
+    """
+    def route(request):
+        if session_id is not None and request_cookies(request).get('sessionid') != session_id:
+            return json_response({'message': 'login_required', 'status': 'fail'}, 403)
+        index = int(request['query'].get('max_id', ['0'])[0])
+        body = {'items': pages[index], 'more_available': index + 1 < len(pages), 'status': 'ok'}
+        if index + 1 < len(pages):
+            body['next_max_id'] = str(index + 1)
+        return json_response(body)
+    return route
+
+def login_routes(username, password, session_id='stand-in-session'):
+    """Routes for the homepage (hands out a csrftoken) and the login endpoint (hands out session_id)"""
+    def homepage(request):
+        return 200, 'text/html', b'<html></html>', {'Set-Cookie': 'csrftoken=stand-in-csrf; Path=/'}
+
+    def login(request):
+        form = parse_qs(request['body'].decode('utf-8'))
+        if form.get('username') == [username] and form.get('password') == [password]:
+            return json_response({'authenticated': True, 'user': True, 'status': 'ok'}, headers={
+                'Set-Cookie': 'sessionid={0}; Path=/; Max-Age=86400'.format(session_id)})
+        return json_response({'authenticated': False, 'user': True, 'status': 'ok'})
+
+    return {'/': homepage, '/accounts/login/ajax/': login}
+
+class StandInServer:
+    """
+    Serves registered paths from a background thread
+
+    images: dict of path -> bytes
+    routes: dict of path -> function(request) returning (status, content type, body bytes, headers),
+       where request is a dict with 'method', 'path' (with the query string), 'query' (parsed query
+       string), 'headers' and 'body'; headers can be a dict or a list of (name, value) pairs
+    fallback: route for paths not in routes or images
+    delay: seconds to wait before answering each request
+    delays: dict of path (without the query string) -> seconds, overriding delay for that path
+    """
+
+    def __init__(self, images=None, delay=0.0, host='127.0.0.1', port=0, routes=None, fallback=None, delays=None):
+        self.images = dict(images or {})
+        self.delays = dict(delays or {})
+        self.routes = dict(routes or {})
+        self.fallback = fallback
+        self.delay = delay
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def handle_request(self, method):
+                server.requests.append(self.path)
+                url = urlsplit(self.path)
+                delay = server.delays.get(url.path, server.delay)
+                if delay:
+                    time.sleep(delay)
+                length = int(self.headers.get('Content-Length') or 0)
+                request = {'method': method, 'path': self.path, 'query': parse_qs(url.query), 'headers': self.headers,
+                           'body': self.rfile.read(length) if length else b''}
+                if url.path in server.routes:
+                    status, content_type, body, headers = server.routes[url.path](request)
+                elif url.path not in server.images and server.fallback is not None:
+                    status, content_type, body, headers = server.fallback(request)
+                else:
+                    status, content_type, body, headers = 200, 'image/jpeg', server.images.get(url.path), {}
+                if body is None:
+                    self.send_error(404)
+                    return
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers.items() if isinstance(headers, dict) else headers):
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self.handle_request('GET')
+
+            def do_POST(self):
+                self.handle_request('POST')
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://{0}:{1}'.format(host, port)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,103 @@
+"""
+Per-stage timing for --profile
+
+Instrumentation calls are no-ops until enable() is called, so they cost one global check when
+profiling is off.
+"""
+
+import json
+import time
+
+_events = None
+_started = None
+
+class _NullStage:
+    bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+class _Stage:
+    def __init__(self, name, post):
+        self.name = name
+        self.post = post
+        self.bytes = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.start, self.bytes, self.post, start=self.start)
+        return False
+
+def enable():
+    global _events, _started
+    _events = []
+    _started = time.perf_counter()
+
+def enabled():
+    return _events is not None
+
+def stage(name, post=None):
+    """Context manager timing a stage. Set .bytes on the returned object to record a byte count"""
+    if _events is None:
+        return _NULL_STAGE
+    return _Stage(name, post)
+
+def record(name, seconds, nbytes=0, post=None, start=None, **extra):
+    """Record an already timed stage (e.g. measured in a worker thread or process)"""
+    if _events is None:
+        return
+    event = {'stage': name, 'seconds': seconds, 'bytes': nbytes}
+    if start is not None:
+        event['start'] = start - _started
+    if post is not None:
+        event['post'] = post
+    event.update(extra)
+    _events.append(event)      # list.append is atomic, so worker threads can record directly
+
+def summary():
+    """Return {stage: {'count', 'seconds', 'mean', 'max', 'bytes'}} in first seen order"""
+    stages = {}
+    for event in list(_events or []):
+        s = stages.setdefault(event['stage'], {'count': 0, 'seconds': 0.0, 'max': 0.0, 'bytes': 0})
+        s['count'] += 1
+        s['seconds'] += event['seconds']
+        s['max'] = max(s['max'], event['seconds'])
+        s['bytes'] += event['bytes']
+    for s in stages.values():
+        s['mean'] = s['seconds'] / s['count']
+    return stages
+
+def cache_rates(caches):
+    """Hit rates of objects with hits/misses counters, e.g. {'image': ImageCache, 'render': RenderCache}"""
+    rates = {}
+    for name, cache in caches.items():
+        if cache is None:
+            continue
+        lookups = cache.hits + cache.misses
+        rates[name] = {'hits': cache.hits, 'misses': cache.misses, 'hit_rate': cache.hits / lookups if lookups else None}
+    return rates
+
+def print_summary(caches=None, out=None):
+    import sys
+    out = out or sys.stderr
+    out.write('\n{0:<12} {1:>7} {2:>11} {3:>10} {4:>10} {5:>12}\n'.format('stage', 'count', 'total ms', 'mean ms', 'max ms', 'bytes'))
+    for name, s in summary().items():
+        out.write('{0:<12} {1:>7} {2:>11.1f} {3:>10.2f} {4:>10.2f} {5:>12}\n'.format(
+            name, s['count'], s['seconds'] * 1000, s['mean'] * 1000, s['max'] * 1000, s['bytes']))
+    out.write('wall time: {0:.1f} ms\n'.format((time.perf_counter() - _started) * 1000))
+    for name, rate in cache_rates(caches or {}).items():
+        hit_rate = '-' if rate['hit_rate'] is None else '{0:.0%}'.format(rate['hit_rate'])
+        out.write('{0} cache: {1} hits, {2} misses ({3})\n'.format(name, rate['hits'], rate['misses'], hit_rate))
+
+def write_trace(path, caches=None):
+    with open(path, 'w') as f:
+        json.dump({'wall_seconds': time.perf_counter() - _started, 'stages': summary(),
+                   'caches': cache_rates(caches or {}), 'events': _events}, f)
@@ -0,0 +1,92 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from image_cache import ImageCache
+
+DEFAULT_RENDER_CACHE_DIR = os.path.join('cache', 'renders')
+DEFAULT_MEMORY_BYTES = 16 * 1024 * 1024
+DEFAULT_DISK_BYTES = 64 * 1024 * 1024
+
+def image_digest(img):
+    """Digest of the decoded pixels - identifies an image at its render size"""
+    digest = hashlib.sha1(img.tobytes())
+    digest.update('{0}x{1}:{2}'.format(img.width, img.height, img.mode).encode('utf-8'))
+    return digest.hexdigest()
+
+def render_key(img, mode, width, settings):
+    parts = [image_digest(img), mode, str(width)]
+    parts += ['{0}={1}'.format(name, settings[name]) for name in sorted(settings)]
+    return '|'.join(parts)
+
+class RenderCache:
+    """
+    Cache of rendered text keyed by (image digest, mode, terminal width, render settings)
+
+    Entries live in an in-memory LRU bounded by memory_bytes. Entries evicted from memory spill to an
+    on-disk ImageCache (bounded by disk_bytes, with its own LRU eviction) and are promoted back on a hit.
+    """
+
+    def __init__(self, memory_bytes=DEFAULT_MEMORY_BYTES, directory=DEFAULT_RENDER_CACHE_DIR, disk_bytes=DEFAULT_DISK_BYTES):
+        self.memory_bytes = memory_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.disk = ImageCache(directory, disk_bytes) if disk_bytes else None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            text = self.entries.get(key)
+            if text is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return text
+        content = self.disk.get(key) if self.disk is not None else None
+        if content is None:
+            with self.lock:
+                self.misses += 1
+            return None
+        text = content.decode('utf-8')
+        with self.lock:
+            self.hits += 1
+        self.remember(key, text)
+        return text
+
+    def put(self, key, text):
+        self.remember(key, text)
+
+    def remember(self, key, text):
+        spilled = []
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= len(self.entries.pop(key))
+            self.entries[key] = text
+            self.total_bytes += len(text)
+            while self.total_bytes > self.memory_bytes and len(self.entries) > 1:
+                old_key, old_text = self.entries.popitem(last=False)
+                self.total_bytes -= len(old_text)
+                spilled.append((old_key, old_text))
+        if self.disk is not None:
+            for old_key, old_text in spilled:
+                self.disk.put(old_key, old_text.encode('utf-8'))
+
+    def render(self, img, mode, width, settings, render_func):
+        """Return render_func(img, **settings), served from the cache when possible"""
+        key = render_key(img, mode, width, settings)
+        text = self.get(key)
+        if text is None:
+            text = render_func(img, **settings)
+            self.put(key, text)
+        return text
+
+    def save(self):
+        """Spill everything still in memory and persist the disk index"""
+        if self.disk is None:
+            return
+        with self.lock:
+            entries = list(self.entries.items())
+        for key, text in entries:
+            self.disk.put(key, text.encode('utf-8'))
+        self.disk.save()
@@ -1,9 +1,32 @@
+import sys
+import last_feed
+
+if __name__ == '__main__':
+    # Show the last feed before the slow imports below (requests, numpy, PIL) and any network I/O
+    last_feed.show_saved(sys.argv[1:])
+
 import argparse
+import cProfile
 import getpass
+import heapq
 import json
 import os
+import pstats
 import requests
-from display import display_to_terminal
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from color.dither import DITHER_METHODS
+from display import MODE_ANSI, MODE_BRAILLE, MODE_BRAILLE_COLOR, MODE_HALFBLOCK, MODES, RENDER_OPTIONS, display_stream, prepare_image, render_box, render_pool
+from downloader import DEFAULT_WORKERS, stream_downloads, tune_session
+from feed_store import FeedStore, Post, SeenIds
+from image_cache import DEFAULT_MAX_BYTES, ImageCache
+from render_cache import RenderCache
+import profiler
+import transport
+from export import export_feed
+from viewer import DEFAULT_PREFETCH, Viewer
 
 def get_credential():
     if not os.path.exists('credential.json'):
@@ -16,49 +39,155 @@ def get_credential():
         print('credential.json file not found in current directory. Exiting.')
         exit()
 
-def fetch_news_feed(session):
-    res = session.get('https://i.instagram.com/api/v1/feed/timeline/', headers={
-        'user-agent': 'Mozilla/5.0 (Linux; Android 6.0.1; SM-G935T Build/MMB29M; wv) AppleWebKit/537.36 (KHTML, like Gecko) Version/4.0 Chrome/51.0.2704.81 Mobile Safari/537.36 Instagram 8.4.0 Android (23/6.0.1; 560dpi; 1440x2560; samsung; SM-G935T; hero2qltetmo; qcom; en_US)',
-        'cookie':'sessionid={0};'.format(session.cookies['sessionid'])
-    })
+INSTAGRAM_URL = 'https://www.instagram.com/'
+LOGIN_URL = INSTAGRAM_URL + 'accounts/login/ajax/'
+TWO_FACTOR_URL = LOGIN_URL + 'two_factor/'
+TIMELINE_URL = 'https://i.instagram.com/api/v1/feed/timeline/'
+USER_AGENT = 'Mozilla/5.0 (Linux; Android 6.0.1; SM-G935T Build/MMB29M; wv) AppleWebKit/537.36 (KHTML, like Gecko) Version/4.0 Chrome/51.0.2704.81 Mobile Safari/537.36 Instagram 8.4.0 Android (23/6.0.1; 560dpi; 1440x2560; samsung; SM-G935T; hero2qltetmo; qcom; en_US)'
+DEFAULT_MAX_POSTS = 50
+SESSION_FILE = 'session.json'
+MAX_SESSION_AGE = 30 * 24 * 60 * 60
+DEFAULT_POLL_INTERVAL = 60
+MAX_POLL_INTERVAL = 15 * 60
+MAX_CATCHUP_PAGES = 3
+# open_sessions logs in to several accounts at once - only one of them may ask for a 2FA code at a time
+PROMPT_LOCK = threading.Lock()
+
+class LoginRequired(Exception):
+    """The session was rejected by Instagram - a full login is needed"""
+
+class FetchError(Exception):
+    """The timeline request failed with an unexpected status"""
+
+def fetch_feed_page(session, max_id=None):
+    with profiler.stage('timeline') as stage:
+        res = session.get(TIMELINE_URL, params={'max_id': max_id} if max_id else None, headers={
+            'user-agent': USER_AGENT,
+            'cookie':'sessionid={0};'.format(session.cookies.get('sessionid', ''))
+        })
+        stage.bytes = len(res.content)
+    if res.status_code in (401, 403) or 'login_required' in res.text[:200]:
+        raise LoginRequired()
     if res.status_code != 200:
-        print('ERROR: got '+str(res.status_code)+' when fetching!')
-        exit()
-    res = json.loads(res.text)
-    posts_info = {}
-    for item in res['items']:
+        raise FetchError(res.status_code)
+    return res.json()
+
+def fits_box(candidate, box):
+    """True if the candidate is at least as large as what it would be scaled to for box"""
+    max_width, max_height, aspect_ratio = box
+    width, height = candidate.get('width'), candidate.get('height')
+    if not width or not height:
+        return False
+    return width >= max_width or height * aspect_ratio >= max_height
+
+def pick_candidate(candidates, boxes=()):
+    """
+    Return the url of the smallest candidate that still fills every render box without upscaling
+
+    Falls back to the largest candidate when none is large enough, and to the first one (Instagram
+    lists the original first) when sizes are missing.
+    """
+    if not all(c.get('width') and c.get('height') for c in candidates):
+        return candidates[0]['url']
+    sized = sorted(candidates, key=lambda c: c['width'] * c['height'])
+    if boxes:
+        for candidate in sized:
+            if all(fits_box(candidate, box) for box in boxes):
+                return candidate['url']
+    return sized[-1]['url']
+
+def parse_feed_items(items, boxes=()):
+    """
+    Yield a Post for every image or carousel post in a timeline page
+
+    Post.image_urls has one image per carousel page (just one for single images), each the smallest
+    candidate that fills the render boxes (see display.render_box).
+    """
+    for item in items:
         if 'user' not in item: continue
-        username = item['user']['username']
-        key = username + '_' +  str(item['taken_at']) + '.jpg'
         try:
-            posts_info[key] = {
-                'username': username,
-                'caption': item['caption']['text'] if item['caption'] else '',
-                'image_url': item['image_versions2']['candidates'][0]['url'],
-                'likes': str(item['like_count']) if item['like_count'] else '0',
-                'site_url': 'https://www.instagram.com/p/' + item['code'] + '/?taken-by=' + username
-            }
-        except KeyError:
+            media = item.get('carousel_media') or [item]
+            image_urls = [pick_candidate(m['image_versions2']['candidates'], boxes) for m in media if 'image_versions2' in m]
+            if not image_urls:
+                continue
+            yield Post(item['id'], item['user']['username'],
+                       item['caption']['text'] if item['caption'] else '',
+                       image_urls, item['like_count'] or 0, item['code'], item.get('taken_at') or 0)
+        except (KeyError, IndexError):
             pass
-    return posts_info
 
-def save_image(posts_info, session):
-    if not os.path.exists('images'):
-        os.makedirs('images')
+def iter_pages(posts):
+    """Yield (media id, post_info) per image of each Post, one per page for carousel posts"""
+    for post in posts:
+        for page in range(len(post.image_urls)):
+            yield post.media_id, post.info(page)
 
-    for key in posts_info:
-        res = session.get(posts_info[key]['image_url'])
-        with open('images/' + key, 'wb') as f:
-            for chunk in res.iter_content(chunk_size=1024):
-                if chunk:
-                    f.write(chunk)
+def iter_news_feed(session, max_posts=DEFAULT_MAX_POSTS, time_budget=None, first_page=None, boxes=(), store=None):
+    """
+    Yield Posts across timeline pages, following the next_max_id cursor
 
-def remove_images():
-    if not os.path.isdir('./images'):
-        return
-    file_list = os.listdir('./images/')
-    for filename in file_list:
-        os.remove('./images/' + filename)
+    The next page is requested in the background while the current one is consumed. Stops after
+    max_posts posts, when no more pages are available, or when time_budget seconds have passed
+    (checked before each page request). Only the current and next page are held in memory.
+    first_page can be passed if it has already been fetched. boxes are passed on to parse_feed_items.
+    Each page is merged into store (a fresh FeedStore if not given) and only posts not seen before
+    are yielded.
+    """
+    if store is None:
+        store = FeedStore()
+    deadline = time.monotonic() + time_budget if time_budget else None
+    count = 0
+    prefetcher = ThreadPoolExecutor(max_workers=1)
+    try:
+        if first_page is None:
+            page = prefetcher.submit(fetch_feed_page, session)
+        else:
+            page = Future()
+            page.set_result(first_page)
+        while page is not None:
+            res = page.result()
+            page = None
+            added = store.merge(parse_feed_items(res['items'], boxes))
+            # Only ask for the next page if this one doesn't already fill max_posts
+            if res.get('more_available') and res.get('next_max_id') and (max_posts is None or count + len(added) < max_posts):
+                if deadline is None or time.monotonic() < deadline:
+                    page = prefetcher.submit(fetch_feed_page, session, res['next_max_id'])
+            for post in added:
+                if max_posts is not None and count >= max_posts:
+                    return
+                count += 1
+                yield post
+    finally:
+        # Don't wait for a prefetch nobody will read
+        prefetcher.shutdown(wait=False, cancel_futures=True)
+
+def stream_posts(posts, session, mode, workers=DEFAULT_WORKERS, rate=None, cache=None):
+    """
+    Yield (image, post_info) in feed order as soon as each image is downloaded and decoded
+
+    posts is any iterable of Posts - a FeedStore or the lazy iter_news_feed. Carousel posts are
+    yielded once per page; the pages are downloaded ahead like any other post. session should
+    already be tuned for workers (see show_feed).
+    """
+    pending = deque()
+
+    def jobs():
+        for key, post_info in iter_pages(posts):
+            pending.append(post_info)
+            # Images are kept in memory and decoded straight to their render size - nothing goes to disk
+            yield post_info['image_url'], None
+
+    def prepare(content):
+        with profiler.stage('decode') as stage:
+            stage.bytes = len(content)
+            return prepare_image(content, mode)
+
+    for stat, img in stream_downloads(jobs(), session, workers=workers, rate=rate, prepare=prepare, cache=cache):
+        post_info = pending.popleft()
+        if 'error' in stat:
+            print('ERROR: could not download ' + post_info['image_url'] + ': ' + stat['error'])
+            continue
+        yield img, post_info
 
 def save_credentials(credential, permission):
     if not permission:
@@ -66,18 +195,127 @@ def save_credentials(credential, permission):
     with open('credential.json', 'w') as _file:
         json.dump(credential, _file)
 
+def save_session(session, path=SESSION_FILE):
+    """Persist the authenticated cookie jar so the next start can skip the login round-trips"""
+    cookies = [{'name': c.name, 'value': c.value, 'domain': c.domain, 'path': c.path, 'expires': c.expires, 'secure': c.secure}
+               for c in session.cookies]
+    data = {'saved_at': time.time(), 'csrftoken': session.headers.get('X-CSRFToken'), 'cookies': cookies}
+    # Session cookies are as good as a password, so keep the file private
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    # O_CREAT's mode only applies to new files
+    os.fchmod(fd, 0o600)
+    with os.fdopen(fd, 'w') as _file:
+        json.dump(data, _file)
+
+def load_session(path=SESSION_FILE):
+    """Return a session built from the saved cookie jar, or None if there is none or it has expired"""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as _file:
+            data = json.load(_file)
+    except ValueError:
+        return None
+    now = time.time()
+    if now - data.get('saved_at', 0) > MAX_SESSION_AGE:
+        return None
+    session = transport.new_session()
+    session.headers.update({'Referer': INSTAGRAM_URL})
+    if data.get('csrftoken'):
+        session.headers.update({'X-CSRFToken': data['csrftoken']})
+    for c in data['cookies']:
+        if c['expires'] is not None and c['expires'] < now:
+            continue
+        session.cookies.set(c['name'], c['value'], domain=c['domain'], path=c['path'], expires=c['expires'], secure=c['secure'])
+    if 'sessionid' not in session.cookies:
+        return None
+    return session
+
+def open_session(credential, session_file=SESSION_FILE):
+    """
+    Return (session, first timeline page), reusing the saved session when it is still accepted
+
+    Falls back to a full login (and saves the new session) when there is no saved session or
+    Instagram rejects it.
+    """
+    session = load_session(session_file)
+    if session is not None:
+        try:
+            return session, fetch_feed_page(session)
+        except LoginRequired:
+            print('Saved session expired, logging in again')
+    with profiler.stage('login'):
+        session = login(credential)
+    if session is None:
+        print('ERROR: login failed')
+        exit()
+    save_session(session, session_file)
+    try:
+        return session, fetch_feed_page(session)
+    except LoginRequired:
+        print('ERROR: login failed')
+        exit()
+
+def account_session_file(credential):
+    return 'session.' + credential['username'] + '.json'
+
+def get_accounts(path):
+    """Read a json list of credentials ({"username": ..., "password": ...}) for --accounts"""
+    try:
+        with open(path) as _file:
+            accounts = json.load(_file)
+    except FileNotFoundError:
+        print('ERROR: ' + path + ' not found')
+        exit()
+    if not accounts:
+        print('ERROR: no accounts in ' + path)
+        exit()
+    return accounts
+
+def open_sessions(accounts):
+    """
+    Log in to every account at once, returning [(session, first timeline page)] in account order
+
+    The requests run concurrently; 2FA codes are asked for one account at a time (see PROMPT_LOCK).
+    """
+    with ThreadPoolExecutor(max_workers=len(accounts)) as pool:
+        return list(pool.map(lambda credential: open_session(credential, account_session_file(credential)), accounts))
+
+def merge_feeds(feeds, max_posts=DEFAULT_MAX_POSTS):
+    """
+    Merge Post streams (one per account, each bounded) into one stream ordered by time, without duplicates
+
+    Timelines are ranked, not in time order, so each stream is read in full (concurrently) and sorted
+    before the merge. A post seen on several accounts' timelines is yielded once, so its image is
+    downloaded and rendered once.
+    """
+    newest_first = lambda post: -post.taken_at
+    with ThreadPoolExecutor(max_workers=max(1, len(feeds))) as pool:
+        windows = list(pool.map(lambda feed: sorted(feed, key=newest_first), feeds))
+    store = FeedStore()
+    count = 0
+    for post in heapq.merge(*windows, key=newest_first):
+        if post.media_id in store:
+            continue
+        store.merge([post])
+        count += 1
+        yield post
+        if max_posts is not None and count >= max_posts:
+            return
+
 def get_login_session(credential):
-    session = requests.Session()
-    session.headers.update({'Referer': 'https://www.instagram.com/'})
-    req = session.get('https://www.instagram.com/')
+    session = transport.new_session()
+    session.headers.update({'Referer': INSTAGRAM_URL})
+    req = session.get(INSTAGRAM_URL)
     session.headers.update({'X-CSRFToken': req.cookies['csrftoken']})
-    login_response = session.post('https://www.instagram.com/accounts/login/ajax/', data=credential, allow_redirects=True).json()
+    login_response = session.post(LOGIN_URL, data=credential, allow_redirects=True).json()
     if 'two_factor_required' in login_response and login_response['two_factor_required']:
         identifier = login_response['two_factor_info']['two_factor_identifier']
         username = credential['username']
-        verification_code = input('2FA Verification Code: ')
+        with PROMPT_LOCK:
+            verification_code = input('2FA Verification Code for ' + username + ': ')
         verification_data = {'username': username, 'verificationCode': verification_code, 'identifier': identifier}
-        two_factor_response = session.post('https://www.instagram.com/accounts/login/ajax/two_factor/', data=verification_data, allow_redirects=True).json()
+        two_factor_response = session.post(TWO_FACTOR_URL, data=verification_data, allow_redirects=True).json()
         if two_factor_response['authenticated']:
             return session, two_factor_response
         else:
@@ -110,13 +348,221 @@ def login(credential):
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--color', action='store_true', help='Display image with color')
-    display_color = parser.parse_args().color
-    credential = get_credential()
-    session = login(credential)
-    remove_images()
-    posts_info = fetch_news_feed(session)
-    save_image(posts_info, session)
-    display_to_terminal(posts_info, display_color)
+    parser.add_argument('--halfblock', action='store_true', help='Display image with color, two pixels per character')
+    parser.add_argument('--braille-color', action='store_true', help='Display image as braille dots in color')
+    parser.add_argument('--invert', action='store_true', help='Invert the braille image (for light terminal backgrounds)')
+    parser.add_argument('--ansi-optimize', type=int, choices=(0, 1, 2), default=0,
+                        help='Shrink color output: 1 uses REP and shorter cursor moves, 2 also uses ECH (needs BCE support)')
+    parser.add_argument('--dither', choices=DITHER_METHODS, default=None,
+                        help='Dither braille dots and colors with an ordered (bayer) or error diffusion (floyd-steinberg) pattern')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Number of concurrent image downloads')
+    parser.add_argument('--rate', type=float, default=None, help='Max image requests started per second')
+    parser.add_argument('--accounts', metavar='FILE', help='Show the merged feed of every account in FILE (a json list of credentials)')
+    parser.add_argument('--max-posts', type=int, default=DEFAULT_MAX_POSTS, help='Number of posts to show')
+    parser.add_argument('--time-budget', type=float, default=None, help='Stop fetching more pages after this many seconds')
+    parser.add_argument('--render-workers', type=int, default=os.cpu_count() or 1, help='Number of processes rendering posts')
+    parser.add_argument('--interactive', action='store_true', help='Browse posts one at a time with the keyboard')
+    parser.add_argument('--prefetch', type=int, default=DEFAULT_PREFETCH, help='With --interactive, number of posts loaded ahead')
+    parser.add_argument('--watch', action='store_true', help='Keep running and show new posts as they appear')
+    parser.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL, help='With --watch, seconds between polls while posts keep coming')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024), help='Image cache size in MB (0 disables the cache)')
+    parser.add_argument('--export', metavar='DIR', help='Write every post as braille, ANSI and plain text files to DIR instead of showing them')
+    parser.add_argument('--export-stream', action='store_true', help='With --export, also write all ANSI posts to DIR/feed.ans')
+    parser.add_argument('--export-html', action='store_true', help='With --export, also write an HTML view of the ANSI posts to DIR/feed.html')
+    parser.add_argument('--offline', action='store_true', help='Only show the feed saved by the last run, without connecting')
+    parser.add_argument('--record', metavar='ARCHIVE', help='Save all HTTP responses to ARCHIVE')
+    parser.add_argument('--replay', metavar='ARCHIVE', help='Answer HTTP requests from ARCHIVE instead of the network')
+    parser.add_argument('--replay-speed', type=float, default=1.0, help='With --replay, multiply the recorded latencies by this (0 for none)')
+    parser.add_argument('--profile', action='store_true', help='Print per-stage timings and write a JSON trace')
+    parser.add_argument('--profile-trace', default='profile_trace.json', help='Where --profile writes its JSON trace')
+    parser.add_argument('--cprofile', action='store_true', help='With --profile, also run under cProfile and write profile.pstats')
+    args = parser.parse_args()
+    archive = None
+    if args.replay:
+        transport.ACTIVE = transport.ReplayAdapter(transport.Archive.open(args.replay), args.replay_speed)
+    elif args.record:
+        archive = transport.Archive(args.record)
+        transport.ACTIVE = transport.RecordingAdapter(archive)
+    try:
+        profile_run(args)
+    finally:
+        if archive is not None:
+            archive.save()
+
+def profile_run(args):
+    if not args.profile:
+        run(args)
+        return
+
+    profiler.enable()
+    caches = {}
+    profile = cProfile.Profile() if args.cprofile else None
+    try:
+        if profile is not None:
+            profile.runcall(run, args, caches)
+        else:
+            run(args, caches)
+    finally:
+        profiler.print_summary(caches)
+        profiler.write_trace(args.profile_trace, caches)
+        if profile is not None:
+            profile.dump_stats('profile.pstats')
+            pstats.Stats(profile, stream=sys.stderr).sort_stats('cumulative').print_stats(20)
+
+def poll_feed(session, seen, boxes=(), first_page=None):
+    """
+    Return the posts at the top of the timeline that are not in seen, oldest first
+
+    Usually a single timeline request. Older pages are only requested while every post on the
+    page is new (up to MAX_CATCHUP_PAGES), i.e. after a long time without polling.
+    """
+    res = first_page if first_page is not None else fetch_feed_page(session)
+    new = OrderedDict()
+    for pages in range(1, MAX_CATCHUP_PAGES + 1):
+        posts = list(parse_feed_items(res['items'], boxes))
+        fresh = [post for post in posts if post.media_id not in seen]
+        for post in fresh:
+            new.setdefault(post.media_id, post)
+        if len(fresh) < len(posts) or pages == MAX_CATCHUP_PAGES:
+            break
+        if not (res.get('more_available') and res.get('next_max_id')):
+            break
+        res = fetch_feed_page(session, res['next_max_id'])
+    return list(new.values())[::-1]
+
+def watch(args, session, credential, mode, cache=None, render_cache=None, first_page=None, boxes=()):
+    """
+    Keep polling the timeline, showing only posts not shown before (even by an earlier run)
+
+    Polls every --poll-interval seconds while posts keep coming, slowing down to MAX_POLL_INTERVAL
+    while the feed is quiet and backing off the same way when requests fail. Single new posts are
+    rendered inline; larger batches share one render pool kept for the whole run.
+    """
+    seen = SeenIds()
+    interval = args.poll_interval
+    pool = None
+    try:
+        while True:
+            try:
+                new = poll_feed(session, seen, boxes, first_page)
+            except LoginRequired:
+                session, first_page = open_session(credential)
+                tune_session(session, pool_size=args.workers)
+                continue
+            except (FetchError, requests.RequestException) as e:
+                interval = min(interval * 2, MAX_POLL_INTERVAL)
+                print('ERROR: polling failed (' + str(e) + '), retrying in ' + str(int(interval)) + 's')
+                time.sleep(interval)
+                continue
+            first_page = None
+            if new:
+                batch = new[-args.max_posts:]
+                workers = args.render_workers if len(batch) > 1 else 1
+                if workers > 1 and pool is None:
+                    pool = render_pool(workers)
+                display_stream(stream_posts(batch, session, mode, args.workers, args.rate, cache), mode, render_cache,
+                               workers, pool=pool)
+                for post in new:
+                    seen.add(post.media_id)
+                seen.save()
+                interval = args.poll_interval
+            else:
+                interval = min(interval * 1.5, MAX_POLL_INTERVAL)
+            time.sleep(interval)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+def refresh_feed(args, posts, session, mode, cache=None, render_cache=None):
+    """
+    Show the posts not already shown from the saved last feed, then save the feed for the next start
+
+    Posts on screen from the saved feed are not downloaded or rendered again - their saved text is kept.
+    """
+    feed = OrderedDict()
+
+    def fresh():
+        for post in posts:
+            if post.media_id in last_feed.shown:
+                feed[post.media_id] = last_feed.shown[post.media_id]
+                continue
+            # holds the post's place in feed order until it is rendered
+            feed[post.media_id] = ''
+            yield post
+
+    def on_post(post_info, text):
+        feed[post_info['media_id']] += text
+
+    try:
+        display_stream(stream_posts(fresh(), session, mode, args.workers, args.rate, cache), mode, render_cache,
+                       args.render_workers, on_post)
+    finally:
+        if feed:
+            last_feed.save(feed, sys.argv[1:])
+
+def run(args, caches=None):
+    """Log in, then stream the feed to the terminal. Caches are added to caches (if given) for --profile"""
+    try:
+        show_feed(args, caches)
+    except FetchError as e:
+        print('ERROR: got '+str(e)+' when fetching!')
+        exit()
+    except requests.RequestException as e:
+        # No network: keep whatever last_feed.show_saved already printed
+        if last_feed.shown:
+            print("couldn't refresh: " + type(e).__name__ + ', showing saved feed (use --offline to skip)')
+        else:
+            print("ERROR: couldn't connect to Instagram: " + type(e).__name__)
+        exit()
+
+def show_feed(args, caches=None):
+    mode = (MODE_HALFBLOCK if args.halfblock else MODE_ANSI if args.color else
+            MODE_BRAILLE_COLOR if args.braille_color else MODE_BRAILLE)
+    RENDER_OPTIONS.update({'invert': args.invert, 'ansi_optimize': args.ansi_optimize, 'dither': args.dither})
+    if args.accounts:
+        if args.watch:
+            print('ERROR: --watch only follows one account')
+            exit()
+        credential, first_page = None, None
+        sessions = open_sessions(get_accounts(args.accounts))
+        # Image URLs don't need the account's cookies - any session can download them
+        session = sessions[0][0]
+    else:
+        credential = get_credential()
+        session, first_page = open_session(credential)
+    # Once per session - every download below shares this pool
+    tune_session(session, pool_size=args.workers)
+    cache = ImageCache(max_bytes=args.cache_size * 1024 * 1024) if args.cache_size > 0 else None
+    render_cache = RenderCache() if args.cache_size > 0 else None
+    if caches is not None:
+        caches.update({'image': cache, 'render': render_cache})
+    # The viewer can switch modes, so its images must be large enough for all of them
+    boxes = [render_box(m) for m in (MODES if args.interactive else (mode,))]
+    try:
+        if args.watch:
+            watch(args, session, credential, mode, cache, render_cache, first_page, boxes)
+            return
+        if args.export:
+            # Exported posts are rendered in both braille and color
+            boxes = [render_box(m) for m in (MODE_BRAILLE, MODE_ANSI)]
+        if args.accounts:
+            posts = merge_feeds([iter_news_feed(s, args.max_posts, args.time_budget, page, boxes) for s, page in sessions],
+                                args.max_posts)
+        else:
+            posts = iter_news_feed(session, args.max_posts, args.time_budget, first_page, boxes)
+        if args.export:
+            count = export_feed(iter_pages(posts), session, args.export, args.workers, args.render_workers, args.rate, cache,
+                                args.export_stream, args.export_html)
+            print('Exported ' + str(count) + ' posts to ' + args.export)
+            return
+        if args.interactive:
+            Viewer(iter_pages(posts), session, mode, cache, render_cache, args.prefetch, args.workers).run()
+            return
+        refresh_feed(args, posts, session, mode, cache, render_cache)
+    finally:
+        if cache is not None:
+            cache.save()
+            render_cache.save()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,42 @@
+"""Tests for the color.ansi output paths, checked byte for byte or through color.terminal_model"""
+
+import numpy as np
+
+import color.ansi as ansi
+from color.terminal_model import check_frame_diffs, check_random_frames
+
+
+def random_case(rng, i):
+    height, width = int(rng.integers(1, 12)), int(rng.integers(1, 30))
+    palette = rng.integers(0, 256, (int(rng.integers(1, 6)), 4)).astype(np.uint8)
+    palette[:, 3] = rng.choice([0, 255, 255, 255, 128], len(palette))
+    frame = palette[rng.integers(0, len(palette), (height, width))]
+    bgcolor = None if i % 2 else tuple(int(v) for v in rng.integers(0, 256, 3)) + (255,)
+    colors = None
+    if i % 4 == 1:
+        colors = {'fg': int(rng.integers(0, 256)), 'bg': None if i % 8 == 1 else int(rng.integers(0, 256))}
+    cursor = {'x': int(rng.integers(0, 5)), 'y': int(rng.integers(0, 3))} if i % 5 == 2 else None
+    return frame, dict(bgcolor_rgba=bgcolor, current_ansi_colors=colors, current_cursor_pos=cursor,
+                       is_overdraw=i % 3 == 0, x_offset=int(rng.integers(0, 4)) if i % 6 == 3 else 0)
+
+
+def test_rgba_array_matches_pixels_byte_for_byte():
+    rng = np.random.default_rng(1)
+    for i in range(400):
+        frame, kwargs = random_case(rng, i)
+        height, width = frame.shape[:2]
+        pixels = dict(((x, y), tuple(int(v) for v in frame[y, x])) for y in range(height) for x in range(width))
+        expected = ansi.generate_ANSI_from_pixels(pixels, width, height, **kwargs)
+        actual = ansi.generate_ANSI_from_rgba_array(frame, **kwargs)
+        assert actual == expected, 'frame {0}'.format(i)
+
+
+def test_optimization_levels_draw_the_same_screen():
+    totals = check_random_frames()
+    assert totals[ansi.OPTIMIZE_SAFE] <= totals[ansi.OPTIMIZE_NONE]
+    assert totals[ansi.OPTIMIZE_BCE] <= totals[ansi.OPTIMIZE_SAFE]
+
+
+def test_frame_diffs_draw_the_same_screen():
+    full_bytes, diff_bytes = check_frame_diffs()
+    assert diff_bytes < full_bytes
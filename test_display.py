@@ -0,0 +1,55 @@
+"""Tests for the braille and color renderers in display.py"""
+
+import numpy as np
+from PIL import Image
+
+import display
+from color.terminal_model import CSI_RE
+
+
+def gradient_image(width=40, height=40, mode='RGB'):
+    y, x = np.mgrid[0:height, 0:width]
+    pixels = np.stack([x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height)], axis=2).astype(np.uint8)
+    img = Image.fromarray(pixels, 'RGB')
+    return img.convert(mode) if mode != 'RGB' else img
+
+
+def test_img_to_braille_fresh_noise():
+    # seed=None draws fresh noise but must still render
+    text = display.img_to_braille(gradient_image(), char_width=2, seed=None)
+    assert len(text.splitlines()) == 10
+    assert all(0x2800 <= ord(c) < 0x2900 for c in text.replace('\n', ''))
+
+
+def test_img_to_braille_seed_is_reproducible():
+    img = gradient_image()
+    assert display.img_to_braille(img, char_width=2, seed=3) == display.img_to_braille(img, char_width=2, seed=3)
+
+
+def test_loaders_fill_render_box(monkeypatch):
+    monkeypatch.setenv('COLUMNS', '81')
+    monkeypatch.setenv('LINES', '46')
+    source = gradient_image(640, 640)
+    for mode in display.MODES:
+        max_width, max_height, aspect_ratio = display.render_box(mode)
+        img = display.prepare_image(source, mode)
+        # within the box and filling it along one side
+        assert img.width <= max_width and img.height <= max_height
+        assert max_width - img.width <= 1 or max_height - img.height <= 1, mode
+
+
+def test_color_braille_flat_image_is_full_glyphs_in_one_color():
+    img = Image.new('RGBA', (20, 16), (200, 40, 40, 255))
+    text = display.img_to_color_braille(img)
+    assert text.count('\x1b[38;5;') == 1
+    assert set(CSI_RE.sub('', text).replace('\n', '')) == {'⣿'}
+
+
+def test_color_braille_shape_follows_detail():
+    # left column of dots bright, right column dark: every cell raises only its left dots
+    pixels = np.zeros((8, 8, 4), dtype=np.uint8)
+    pixels[..., 3] = 255
+    pixels[:, 0::2, :3] = 255
+    text = display.img_to_color_braille(Image.fromarray(pixels, 'RGBA'))
+    glyphs = [c for c in text if ord(c) >= 0x2800]
+    assert glyphs == ['⡇'] * 8
@@ -0,0 +1,86 @@
+"""Tests for downloader.py against the local stand-in server"""
+
+import time
+
+import requests
+
+from downloader import TokenBucket, download_image, stream_downloads, tune_session
+from image_cache import ImageCache
+from local_server import StandInServer, make_image
+
+
+def test_results_come_back_in_job_order():
+    images = dict(('/img/{0}'.format(i), make_image(16, 16, seed=i)) for i in range(6))
+    # the first jobs are the slowest, so they finish last
+    delays = dict((path, 0.05 * (6 - i)) for i, path in enumerate(images))
+    with StandInServer(images, delays=delays) as server:
+        jobs = [(server.url + path, None) for path in images]
+        results = list(stream_downloads(jobs, requests.Session(), workers=6))
+    assert [stats['url'] for stats, _ in results] == [url for url, _ in jobs]
+    assert [stats['bytes'] for stats, _ in results] == [len(content) for content in images.values()]
+
+
+def test_prepare_runs_on_content():
+    with StandInServer({'/a': b'abc'}) as server:
+        [(stats, prepared)] = stream_downloads([(server.url + '/a', None)], requests.Session(), prepare=len)
+    assert prepared == 3
+    assert 'content' not in stats
+
+
+def test_503_is_retried():
+    answers = [(503, 'text/plain', b'busy', {}), (200, 'image/jpeg', b'image', {})]
+    with StandInServer(routes={'/flaky': lambda request: answers.pop(0)}) as server:
+        session = tune_session(requests.Session(), retries=2, backoff=0)
+        stats = download_image(session, server.url + '/flaky')
+        assert stats['content'] == b'image'
+        assert server.requests == ['/flaky', '/flaky']
+
+
+def test_read_timeout_is_an_error_stat():
+    with StandInServer({'/slow': b'late', '/fast': b'ok'}, delays={'/slow': 1.0}) as server:
+        session = tune_session(requests.Session(), retries=0)
+        jobs = [(server.url + '/slow', None), (server.url + '/fast', None)]
+        (slow, _), (fast, _) = stream_downloads(jobs, session, timeout=(1, 0.2))
+    assert 'error' in slow and slow['bytes'] == 0
+    assert 'error' not in fast
+
+
+def test_rate_spaces_requests():
+    images = dict(('/img/{0}'.format(i), b'x') for i in range(8))
+    with StandInServer(images) as server:
+        jobs = [(server.url + path, None) for path in images]
+        start = time.monotonic()
+        list(stream_downloads(jobs, requests.Session(), workers=8, rate=4))
+        elapsed = time.monotonic() - start
+    # a burst of 4, then the other 4 at 4 per second
+    assert elapsed >= 0.9
+
+
+def test_token_bucket_burst_then_rate():
+    bucket = TokenBucket(20, capacity=2)
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    assert time.monotonic() - start >= 0.15
+
+
+def test_cache_hit_makes_no_request(tmp_path):
+    with StandInServer({'/a.jpg': b'image'}) as server:
+        cache = ImageCache(str(tmp_path))
+        session = requests.Session()
+        first = download_image(session, server.url + '/a.jpg?sig=1', cache=cache)
+        second = download_image(session, server.url + '/a.jpg?sig=2', cache=cache)
+        assert server.requests == ['/a.jpg?sig=1']
+    assert not first['cached'] and second['cached']
+    assert second['content'] == b'image'
+
+
+def test_tune_session_closes_replaced_adapters():
+    session = requests.Session()
+    closed = []
+    for adapter in set(session.adapters.values()):
+        adapter.close = lambda adapter=adapter: closed.append(adapter)
+    old = set(session.adapters.values())
+    tune_session(session, pool_size=4)
+    assert set(closed) == old
+    assert session.adapters['https://'].poolmanager.connection_pool_kw['maxsize'] == 4
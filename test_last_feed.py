@@ -0,0 +1,40 @@
+"""Tests for the saved feed shown at startup"""
+
+from collections import OrderedDict
+
+import last_feed
+
+
+def save_feed(monkeypatch, tmp_path, argv, columns='80', lines='40'):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('COLUMNS', columns)
+    monkeypatch.setenv('LINES', lines)
+    monkeypatch.setattr(last_feed, 'shown', OrderedDict())
+    last_feed.save(OrderedDict([('1', 'post one\n'), ('2', 'post two\n')]), argv)
+
+
+def test_saved_feed_is_shown_for_same_options_and_size(monkeypatch, tmp_path, capsys):
+    save_feed(monkeypatch, tmp_path, ['--color'])
+    last_feed.show_saved(['--color', '--max-posts', '5'])
+    assert capsys.readouterr().out == 'post one\npost two\n'
+    assert list(last_feed.shown) == ['1', '2']
+
+
+def test_saved_feed_is_keyed_by_render_options(monkeypatch, tmp_path, capsys):
+    save_feed(monkeypatch, tmp_path, ['--color'])
+    last_feed.show_saved([])
+    last_feed.show_saved(['--accounts', 'accounts.json', '--color'])
+    assert capsys.readouterr().out == ''
+
+
+def test_saved_feed_is_skipped_after_resize(monkeypatch, tmp_path, capsys):
+    save_feed(monkeypatch, tmp_path, [])
+    monkeypatch.setenv('LINES', '30')
+    last_feed.show_saved([])
+    assert capsys.readouterr().out == ''
+
+
+def test_saved_feed_is_skipped_in_watch_mode(monkeypatch, tmp_path, capsys):
+    save_feed(monkeypatch, tmp_path, [])
+    last_feed.show_saved(['--watch'])
+    assert capsys.readouterr().out == ''
@@ -0,0 +1,120 @@
+"""Tests for the login, timeline and parsing code in start.py, against the local stand-in server"""
+
+import json
+import time
+
+import pytest
+
+import start
+from local_server import StandInServer, login_routes, make_feed_item, timeline_route
+
+CREDENTIAL = {'username': 'bob', 'password': 'pw'}
+LOGIN_PATH = '/accounts/login/ajax/'
+
+
+def feed_pages(url, pages=3, per_page=4):
+    return [[make_feed_item('{0}_{1}'.format(p, i), url + '/{0}_{1}.jpg'.format(p, i)) for i in range(per_page)]
+            for p in range(pages)]
+
+
+@pytest.fixture
+def server(monkeypatch):
+    """A stand-in Instagram accepting CREDENTIAL, serving a 3 page timeline to the 'sid' session"""
+    routes = login_routes(CREDENTIAL['username'], CREDENTIAL['password'], 'sid')
+    with StandInServer(routes=routes) as server:
+        server.routes['/feed/'] = timeline_route(feed_pages(server.url), 'sid')
+        monkeypatch.setattr(start, 'INSTAGRAM_URL', server.url + '/')
+        monkeypatch.setattr(start, 'LOGIN_URL', server.url + LOGIN_PATH)
+        monkeypatch.setattr(start, 'TIMELINE_URL', server.url + '/feed/')
+        yield server
+
+
+def login_count(server):
+    return sum(1 for path in server.requests if path.startswith(LOGIN_PATH))
+
+
+def test_open_session_reuses_saved_session(server, tmp_path):
+    session_file = str(tmp_path / 'session.json')
+    _, first_page = start.open_session(CREDENTIAL, session_file)
+    assert login_count(server) == 1
+    assert first_page['items'][0]['id'] == '0_0'
+
+    session, first_page = start.open_session(CREDENTIAL, session_file)
+    assert login_count(server) == 1
+    assert session.cookies.get('sessionid') == 'sid'
+    assert first_page['items'][0]['id'] == '0_0'
+
+
+def test_open_session_logs_in_when_saved_session_is_rejected(server, tmp_path):
+    session_file = str(tmp_path / 'session.json')
+    start.open_session(CREDENTIAL, session_file)
+    with open(session_file) as f:
+        data = json.load(f)
+    for cookie in data['cookies']:
+        if cookie['name'] == 'sessionid':
+            cookie['value'] = 'expired'
+    with open(session_file, 'w') as f:
+        json.dump(data, f)
+
+    session, first_page = start.open_session(CREDENTIAL, session_file)
+    assert login_count(server) == 2
+    assert session.cookies.get('sessionid') == 'sid'
+    assert first_page['status'] == 'ok'
+
+
+def test_iter_news_feed_follows_cursor(server, tmp_path):
+    session, first_page = start.open_session(CREDENTIAL, str(tmp_path / 'session.json'))
+    posts = list(start.iter_news_feed(session, max_posts=None, first_page=first_page))
+    assert [post.media_id for post in posts] == ['{0}_{1}'.format(p, i) for p in range(3) for i in range(4)]
+    assert [path for path in server.requests if path.startswith('/feed/')] == ['/feed/', '/feed/?max_id=1', '/feed/?max_id=2']
+
+
+def test_iter_news_feed_stops_at_max_posts(server, tmp_path):
+    session, first_page = start.open_session(CREDENTIAL, str(tmp_path / 'session.json'))
+    posts = list(start.iter_news_feed(session, max_posts=5, first_page=first_page))
+    assert [post.media_id for post in posts] == ['0_0', '0_1', '0_2', '0_3', '1_0']
+    assert [path for path in server.requests if path.startswith('/feed/')] == ['/feed/', '/feed/?max_id=1']
+
+
+def test_iter_news_feed_skips_prefetch_once_page_fills_max_posts(server, tmp_path):
+    session, first_page = start.open_session(CREDENTIAL, str(tmp_path / 'session.json'))
+    posts = list(start.iter_news_feed(session, max_posts=4, first_page=first_page))
+    assert len(posts) == 4
+    assert [path for path in server.requests if path.startswith('/feed/')] == ['/feed/']
+
+
+def test_iter_news_feed_close_does_not_wait_for_prefetch(server, tmp_path):
+    session, first_page = start.open_session(CREDENTIAL, str(tmp_path / 'session.json'))
+    server.delay = 1.0
+    posts = start.iter_news_feed(session, max_posts=None, first_page=first_page)
+    next(posts)
+    started = time.monotonic()
+    posts.close()
+    assert time.monotonic() - started < 0.5
+
+
+def test_parse_feed_items_carousel():
+    urls = ['https://cdn/a.jpg', 'https://cdn/b.jpg']
+    items = [make_feed_item('1', 'https://cdn/cover.jpg', carousel_urls=urls), make_feed_item('2', 'https://cdn/c.jpg')]
+    carousel, single = start.parse_feed_items(items)
+    assert carousel.image_urls == tuple(urls)
+    assert carousel.info(1)['image_url'] == urls[1]
+    assert carousel.info(1)['page'] == '2/2'
+    assert single.image_urls == ('https://cdn/c.jpg',)
+    assert 'page' not in single.info()
+
+
+def test_pick_candidate():
+    candidates = [{'url': 'big', 'width': 1080, 'height': 1080}, {'url': 'small', 'width': 320, 'height': 320},
+                  {'url': 'medium', 'width': 640, 'height': 640}]
+    assert start.pick_candidate(candidates, [(600, 600, 1.0)]) == 'medium'
+    assert start.pick_candidate(candidates, [(2000, 2000, 1.0)]) == 'big'
+    assert start.pick_candidate([{'url': 'first'}, {'url': 'second', 'width': 10, 'height': 10}]) == 'first'
+
+
+def test_save_session_tightens_existing_file(server, tmp_path):
+    session_file = tmp_path / 'session.json'
+    session_file.write_text('{}')
+    session_file.chmod(0o644)
+    start.open_session(CREDENTIAL, str(session_file))
+    assert session_file.stat().st_mode & 0o777 == 0o600
@@ -0,0 +1,44 @@
+"""Tests for the same-size color redraws in viewer.py"""
+
+import io
+
+import numpy as np
+from PIL import Image
+
+from color.terminal_model import TerminalModel
+from display import MODE_ANSI, prepare_image, render_post
+from viewer import CLEAR_SCREEN, Viewer
+
+POST = {'username': 'bob', 'site_url': 'https://www.instagram.com/p/C1', 'likes': '1', 'caption': 'caption'}
+
+
+def color_image(seed, width=30, height=30, red_block=False):
+    """Random pixels, prepared for MODE_ANSI like the viewer's images are"""
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    if red_block:
+        pixels[10:20, 10:14] = (255, 0, 0)
+    return prepare_image(Image.fromarray(pixels, 'RGB'), MODE_ANSI)
+
+
+def test_redraw_color_only_sends_changed_cells(monkeypatch):
+    monkeypatch.setenv('COLUMNS', '40')
+    monkeypatch.setenv('LINES', '30')
+    viewer = Viewer([], None, MODE_ANSI, out=io.StringIO())
+    first, second = color_image(1), color_image(1, red_block=True)
+
+    drawn = viewer.redraw_color(first, POST, 'status\n')
+    redrawn = viewer.redraw_color(second, dict(POST, likes='2'), 'status\n')
+    full = CLEAR_SCREEN + render_post(second, dict(POST, likes='2'), MODE_ANSI) + 'status\n'
+
+    assert TerminalModel(40).feed(drawn).feed(redrawn).screen() == TerminalModel(40).feed(full).screen()
+    assert len(redrawn) < len(full) / 4
+
+
+def test_redraw_color_falls_back_when_the_screen_would_scroll(monkeypatch):
+    monkeypatch.setenv('COLUMNS', '40')
+    monkeypatch.setenv('LINES', '30')
+    viewer = Viewer([], None, MODE_ANSI, out=io.StringIO())
+    # a caption wider than the terminal wraps and would push the screen off the top
+    assert viewer.redraw_color(color_image(1), dict(POST, caption='x' * 40), 'status\n') is None
+    assert viewer.differ is None
@@ -0,0 +1,222 @@
+"""
+Record and replay of the HTTP traffic of a run, for reproducing and benchmarking offline
+
+    python3 start.py --record feed.replay          # use Instagram as usual, saving every response
+    python3 start.py --replay feed.replay          # run again from the archive, with the original latency
+    python3 start.py --replay feed.replay --replay-speed 0   # ... or without any
+    python3 transport.py feed.replay --port 8000   # serve the archive over HTTP
+
+An archive is a zip of index.json (one entry per response, in the order they were received) and
+the response bodies, stored once per distinct body.
+"""
+
+import argparse
+import hashlib
+import http.client
+import io
+import json
+import os
+import threading
+import time
+import zipfile
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from urllib3 import HTTPResponse
+from urllib3._collections import HTTPHeaderDict
+
+INDEX_FILE = 'index.json'
+# Bodies are stored decoded, so the first three no longer describe them; the rest aren't needed
+DROPPED_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding', 'date', 'server')
+
+# Adapter mounted on every session made by new_session() - set from the command line (see start.main)
+ACTIVE = None
+
+def new_session():
+    """A requests.Session going through the active recording or replaying transport, if any"""
+    session = requests.Session()
+    if ACTIVE is not None:
+        session.mount('https://', ACTIVE)
+        session.mount('http://', ACTIVE)
+    return session
+
+class RecordedMessage:
+    """Stands in for the http.client response urllib3 wraps - requests reads Set-Cookie from its msg"""
+
+    def __init__(self, headers):
+        self.msg = http.client.HTTPMessage()
+        for name, value in headers:
+            self.msg[name] = value
+
+    def isclosed(self):
+        return True
+
+def request_key(method, url):
+    return method.upper() + ' ' + url
+
+class Archive:
+    """Responses in the order they were received, with bodies deduplicated by sha1"""
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = []
+        self.bodies = {}
+        self.lock = threading.Lock()
+        self.zip = None
+
+    @classmethod
+    def open(cls, path):
+        archive = cls(path)
+        archive.zip = zipfile.ZipFile(path)
+        archive.entries = json.loads(archive.zip.read(INDEX_FILE).decode('utf-8'))
+        return archive
+
+    def add(self, method, url, status, reason, headers, body, latency):
+        digest = hashlib.sha1(body).hexdigest()
+        with self.lock:
+            self.bodies[digest] = body
+            self.entries.append({'key': request_key(method, url), 'status': status, 'reason': reason,
+                                 'headers': headers, 'body': digest, 'latency': round(latency, 4)})
+
+    def body(self, digest):
+        with self.lock:
+            if digest not in self.bodies:
+                self.bodies[digest] = self.zip.read('bodies/' + digest)
+            return self.bodies[digest]
+
+    def save(self):
+        """Write the archive, readable by the owner only - it holds the session cookies of the run"""
+        with self.lock:
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            # O_CREAT's mode only applies to new files
+            os.fchmod(fd, 0o600)
+            with os.fdopen(fd, 'wb') as f, zipfile.ZipFile(f, 'w') as out:
+                out.writestr(INDEX_FILE, json.dumps(self.entries), zipfile.ZIP_DEFLATED)
+                for digest, body in self.bodies.items():
+                    # Images are already compressed - deflating them again only costs time
+                    compress = zipfile.ZIP_STORED if body[:3] in (b'\xff\xd8\xff', b'\x89PN') else zipfile.ZIP_DEFLATED
+                    out.writestr('bodies/' + digest, body, compress)
+
+class RecordingAdapter(BaseAdapter):
+    """Sends requests through an HTTPAdapter and adds every response to an Archive"""
+
+    def __init__(self, archive, adapter=None):
+        super().__init__()
+        self.archive = archive
+        self.adapter = adapter or HTTPAdapter()
+
+    def wrap(self, adapter):
+        """Send through adapter from now on (lets downloader.tune_session size the pool)"""
+        self.adapter = adapter
+
+    def send(self, request, **kwargs):
+        start = time.monotonic()
+        res = self.adapter.send(request, **kwargs)
+        body = res.content
+        headers = [(name, value) for name, value in res.raw.headers.items() if name.lower() not in DROPPED_HEADERS]
+        self.archive.add(request.method, request.url, res.status_code, res.reason, headers, body, time.monotonic() - start)
+        return res
+
+    def close(self):
+        self.adapter.close()
+
+class ReplayAdapter(HTTPAdapter):
+    """
+    Answers requests from an Archive after the recorded latency times speed
+
+    Repeated requests get the recorded responses in order, the last one repeating once they run out.
+    Requests that were never recorded get a 404.
+    """
+
+    def __init__(self, archive, speed=1.0):
+        super().__init__()
+        self.archive = archive
+        self.speed = speed
+        self.responses = {}
+        for entry in archive.entries:
+            self.responses.setdefault(entry['key'], []).append(entry)
+        self.served = {}
+        self.lock = threading.Lock()
+
+    def wrap(self, adapter):
+        pass
+
+    def lookup(self, method, url):
+        key = request_key(method, url)
+        with self.lock:
+            entries = self.responses.get(key)
+            if not entries:
+                return None
+            n = self.served.get(key, 0)
+            self.served[key] = n + 1
+            return entries[min(n, len(entries) - 1)]
+
+    def send(self, request, **kwargs):
+        entry = self.lookup(request.method, request.url)
+        if entry is None:
+            status, reason, headers, body = 404, 'Not Recorded', [], b''
+        else:
+            status, reason, headers, body = entry['status'], entry['reason'], entry['headers'], self.archive.body(entry['body'])
+            if self.speed:
+                time.sleep(entry['latency'] * self.speed)
+        raw = HTTPResponse(body=io.BytesIO(body), headers=HTTPHeaderDict(headers), status=status, reason=reason,
+                           preload_content=False, decode_content=False, original_response=RecordedMessage(headers))
+        return self.build_response(request, raw)
+
+def replay_route(archive, base_url):
+    """
+    StandInServer fallback route answering from archive by path and query, whatever the recorded host
+
+    Recorded absolute URLs in text bodies (e.g. image URLs in the timeline) are rewritten to base_url
+    so clients keep talking to the server.
+    """
+    by_path = {}
+    hosts = set()
+    for entry in archive.entries:
+        method, url = entry['key'].split(' ', 1)
+        parts = urlsplit(url)
+        hosts.add(parts.scheme + '://' + parts.netloc)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        by_path.setdefault(request_key(method, path), []).append(entry)
+    served = {}
+    lock = threading.Lock()
+
+    def route(request):
+        key = request_key(request['method'], request['path'])
+        with lock:
+            entries = by_path.get(key)
+            if not entries:
+                return 404, 'text/plain', b'not recorded', {}
+            n = served.get(key, 0)
+            served[key] = n + 1
+        entry = entries[min(n, len(entries) - 1)]
+        headers = [(name, value) for name, value in entry['headers'] if name.lower() != 'content-type']
+        content_type = dict((name.lower(), value) for name, value in entry['headers']).get('content-type', 'application/octet-stream')
+        body = archive.body(entry['body'])
+        if content_type.startswith(('application/json', 'text/')):
+            for host in hosts:
+                body = body.replace(host.encode('utf-8'), base_url.encode('utf-8'))
+                body = body.replace(host.replace('/', '\\/').encode('utf-8'), base_url.replace('/', '\\/').encode('utf-8'))
+        return entry['status'], content_type, body, headers
+    return route
+
+def main():
+    from local_server import StandInServer
+    parser = argparse.ArgumentParser(description='Serve a recorded archive over HTTP')
+    parser.add_argument('archive')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--delay', type=float, default=0.0, help='Seconds to wait before each response')
+    args = parser.parse_args()
+    archive = Archive.open(args.archive)
+    with StandInServer(delay=args.delay, host=args.host, port=args.port) as server:
+        server.fallback = replay_route(archive, server.url)
+        print('Serving ' + str(len(archive.entries)) + ' responses at ' + server.url)
+        try:
+            server.thread.join()
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+import sys
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from color.ansi import FrameDiffer
+from color.dither import dither_rgba
+from color.terminal_model import CSI_RE
+from display import MODE_ANSI, MODES, RENDER_OPTIONS, post_footer, post_header, prepare_image, render_post, render_settings
+from downloader import DEFAULT_WORKERS, download_image
+from image_loader import terminal_size
+import profiler
+
+DEFAULT_PREFETCH = 2
+CLEAR_SCREEN = '\x1b[H\x1b[2J'
+CLEAR_LINE = '\x1b[K'
+CLEAR_BELOW = '\x1b[J'
+HELP = 'n: next  p: previous  g: go to  c: color  i: invert  q: quit'
+
+# Keys, with the arrow keys mapped onto their letters
+KEYS = {'\x1b[C': 'n', '\x1b[B': 'n', ' ': 'n', '\r': 'n', '\x1b[D': 'p', '\x1b[A': 'p', '\x03': 'q'}
+
+def read_key():
+    """Read one key press without waiting for Enter"""
+    if not sys.stdin.isatty():
+        line = sys.stdin.readline()
+        return line.strip()[:1] or 'q'
+    import termios, tty
+    fd = sys.stdin.fileno()
+    old = termios.tcgetattr(fd)
+    try:
+        tty.setraw(fd)
+        key = sys.stdin.read(1)
+        if key == '\x1b':
+            key += sys.stdin.read(2)
+    finally:
+        termios.tcsetattr(fd, termios.TCSADRAIN, old)
+    return KEYS.get(key, key)
+
+class Viewer:
+    """
+    Show the feed one post at a time, moving with the keyboard
+
+    Posts are pulled from the feed only as the viewer reaches them, and images are downloaded and
+    decoded only for the current post and the next prefetch posts (plus the previous one, to make
+    going back instant). Images outside that window are dropped, so memory stays flat however far
+    into the feed you go; going back to them downloads again (or hits the image cache).
+
+    In color mode, moving between images of the same size only redraws the cells that differ (see
+    color.ansi.FrameDiffer), as long as the whole screen fits the terminal without scrolling.
+    """
+    def __init__(self, posts, session, mode, cache=None, render_cache=None, prefetch=DEFAULT_PREFETCH,
+                 workers=DEFAULT_WORKERS, out=sys.stdout):
+        self.feed = iter(posts)
+        self.posts = []
+        self.session = session
+        self.mode = mode
+        self.cache = cache
+        self.render_cache = render_cache
+        self.prefetch = prefetch
+        self.out = out
+        self.index = 0
+        self.images = {}
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        # Tracks the color image on screen, None when the last screen wasn't drawn through it
+        self.differ = None
+
+    def post(self, index):
+        """Return the post_info at index, reading further into the feed if needed (None past the end)"""
+        while len(self.posts) <= index and self.feed is not None:
+            try:
+                self.posts.append(next(self.feed)[1])
+            except StopIteration:
+                self.feed = None
+        return self.posts[index] if 0 <= index < len(self.posts) else None
+
+    def load(self, post_info, mode):
+        stats = download_image(self.session, post_info['image_url'], cache=self.cache)
+        with profiler.stage('decode') as stage:
+            stage.bytes = stats['bytes']
+            return prepare_image(stats['content'], mode)
+
+    def fetch(self):
+        """Start loading the images in the window around the current post and drop the rest"""
+        window = range(max(0, self.index - 1), self.index + self.prefetch + 1)
+        for index in list(self.images):
+            if index not in window:
+                self.images.pop(index).cancel()
+        for index in window:
+            post_info = self.post(index)
+            if post_info is not None and index not in self.images:
+                self.images[index] = self.pool.submit(self.load, post_info, self.mode)
+
+    def show(self):
+        post_info = self.post(self.index)
+        self.fetch()
+        count = str(len(self.posts)) + ('' if self.feed is None else '+')
+        status = '[' + str(self.index + 1) + '/' + count + '] ' + HELP + '\n'
+        screen = None
+        try:
+            img = self.images[self.index].result()
+            if self.mode == MODE_ANSI:
+                screen = self.redraw_color(img, post_info, status)
+            if screen is None:
+                self.differ = None
+                screen = CLEAR_SCREEN + render_post(img, post_info, self.mode, self.render_cache) + status
+        except Exception as e:
+            # Drop the failed load so coming back to this post tries again
+            self.images.pop(self.index, None)
+            self.differ = None
+            screen = CLEAR_SCREEN + 'ERROR: could not load ' + post_info['image_url'] + ': ' + str(e) + '\n' + status
+        self.out.write(screen)
+        self.out.flush()
+
+    def redraw_color(self, img, post_info, status):
+        """
+        Return the screen for a color post drawn through self.differ, or None if it wouldn't fit
+
+        The header and footer are rewritten line by line; the image only gets the cells that changed
+        when the previous screen showed an image of the same size.
+        """
+        settings = render_settings(MODE_ANSI)
+        header, footer = post_header(post_info), post_footer(post_info) + status
+        columns, rows = terminal_size()
+        top = header.count('\n')
+        if top + img.height + footer.count('\n') >= rows or \
+                any(len(CSI_RE.sub('', line)) >= columns for line in (header + footer).split('\n')):
+            return None
+        with profiler.stage('render', post_info['site_url']) as stage:
+            rgba = dither_rgba(np.asarray(img), settings.get('dither_method'))
+            differ = self.differ
+            if differ is None or differ.frame.shape != rgba.shape or differ.optimize != settings['optimize']:
+                differ = self.differ = FrameDiffer(optimize=settings['optimize'])
+                screen = CLEAR_SCREEN + header + differ.draw(rgba)
+            else:
+                screen = '\x1b[H' + ''.join(line + CLEAR_LINE + '\n' for line in header.split('\n')[:-1])
+                # back to where the last draw left the cursor, with the colors the header reset
+                screen += '\x1b[{0};{1}H'.format(top + differ.cursor_pos['y'] + 1, differ.cursor_pos['x'] + 1)
+                differ.ansi_colors = {'fg': None, 'bg': None}
+                screen += differ.draw(rgba)
+            screen += '\x1b[0m\x1b[{0};1H'.format(top + img.height + 1)
+            screen += ''.join(line + CLEAR_LINE + '\n' for line in footer.split('\n')[:-1]) + CLEAR_BELOW
+            stage.bytes = len(screen)
+        return screen
+
+    def go(self, index):
+        if index >= 0 and self.post(index) is not None:
+            self.index = index
+            return True
+        return False
+
+    def set_mode(self, mode):
+        # Images are decoded at a size that depends on the mode, so the window starts over
+        self.mode = mode
+        self.differ = None
+        for future in self.images.values():
+            future.cancel()
+        self.images = {}
+
+    def ask_index(self):
+        self.out.write('Go to post: ')
+        self.out.flush()
+        try:
+            return int(sys.stdin.readline()) - 1
+        except ValueError:
+            return -1
+
+    def run(self):
+        if self.post(0) is None:
+            print('No posts to show')
+            return
+        try:
+            self.show()
+            while True:
+                key = read_key()
+                if key == 'q':
+                    break
+                elif key == 'n':
+                    moved = self.go(self.index + 1)
+                elif key == 'p':
+                    moved = self.go(self.index - 1)
+                elif key == 'g':
+                    moved = self.go(self.ask_index())
+                elif key == 'c':
+                    self.set_mode(MODES[(MODES.index(self.mode) + 1) % len(MODES)])
+                    moved = True
+                elif key == 'i':
+                    RENDER_OPTIONS['invert'] = not RENDER_OPTIONS['invert']
+                    moved = True
+                else:
+                    moved = False
+                if moved:
+                    self.show()
+        finally:
+            self.pool.shutdown(wait=False, cancel_futures=True)